@@ -1,44 +1,66 @@
 import requests
+import threading
 from datetime import datetime, timedelta
 from hotglue_etl_exceptions import InvalidCredentialsError
+from target_imis.transport import IMISTransport
 
 
 class IMISAuth(requests.auth.AuthBase):
-    def __init__(self, config):
+    def __init__(self, config, transport=None):
         self.config = config
-        self.__access_token = None
-        self.__expires_at = None
+        self.transport = transport or IMISTransport()
+        # (access token, expiry), swapped as one so callers outside the lock never see half of it
+        self.__token = None
         self.__credentials_error = None
+        self.__lock = threading.Lock()
+
+    def token_is_valid(self):
+        token = self.__token
+        return token is not None and datetime.now() <= token[1]
 
     def ensure_access_token(self):
         """Ensure that the access token is valid and refresh it if it is not."""
         if self.__credentials_error is not None:
             raise InvalidCredentialsError(self.__credentials_error)
 
-        if self.__access_token is None or datetime.now() > self.__expires_at:
-            site_url = self.config["site_url"].rstrip("/")
-            if not site_url.startswith(("http://", "https://")):
-                site_url = f"https://{site_url}"
-            username = self.config['username']
-            password = self.config['password']
+        if self.token_is_valid():
+            return
 
-            url = f"{site_url}/Token"
+        # Only one caller refreshes the token, the others wait for it
+        with self.__lock:
+            if self.__credentials_error is not None:
+                raise InvalidCredentialsError(self.__credentials_error)
+            if not self.token_is_valid():
+                self.refresh_access_token()
 
-            payload = f"grant_type=password&username={username}&password={password}"
-            headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    def refresh_access_token(self):
+        """Request a new access token with the password grant."""
+        site_url = self.config["site_url"].rstrip("/")
+        if not site_url.startswith(("http://", "https://")):
+            site_url = f"https://{site_url}"
+        username = self.config['username']
+        password = self.config['password']
 
-            response = requests.request("POST", url, headers=headers, data=payload)
-            if response.status_code == 400 and "invalid_grant" in response.text:
-                try:
-                    self.__credentials_error = response.json()["error_description"]
-                except:
-                    self.__credentials_error = response.text
-                raise InvalidCredentialsError(self.__credentials_error)
+        url = f"{site_url}/Token"
+
+        payload = f"grant_type=password&username={username}&password={password}"
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+
+        response = self.transport.request("POST", url, headers=headers, data=payload)
+        if response.status_code == 400 and "invalid_grant" in response.text:
+            try:
+                self.__credentials_error = response.json()["error_description"]
+            except:
+                self.__credentials_error = response.text
+            error = InvalidCredentialsError(self.__credentials_error)
+            if self.transport.metrics:
+                self.transport.metrics.count_error("Token", error)
+            raise error
 
-            response = response.json()
-            self.__access_token = response["access_token"]
-            self.__expires_at = datetime.now() + timedelta(seconds=int(response["expires_in"]) - 10) # 10 seconds buffer
+        response = response.json()
+        expires_at = datetime.now() + timedelta(seconds=int(response["expires_in"]) - 10) # 10 seconds buffer
+        self.__token = (response["access_token"], expires_at)
 
     def __call__(self):
         self.ensure_access_token()
-        return f"Bearer {self.__access_token}"
+        return f"Bearer {self.__token[0]}"
@@ -0,0 +1,190 @@
+"""Caches shared by the IMIS sinks."""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_email(email):
+    """Normalize an email address for use as a lookup key."""
+    return str(email).strip().lower() if email else None
+
+
+class _CacheEntry:
+    __slots__ = ("data", "keys", "expires_at")
+
+    def __init__(self, data, keys, expires_at):
+        self.data = data
+        self.keys = keys
+        self.expires_at = expires_at
+
+
+class PartyCache:
+    """Process-wide LRU cache of Party documents keyed by id and by normalized email.
+
+    Parties are stored serialized, so every read hands out a fresh copy the
+    sinks can mutate, and the memory cap is enforced on the serialized size.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=900):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 and self.ttl > 0
+
+    @staticmethod
+    def party_keys(party):
+        """Return the cache keys a Party document is reachable by."""
+        keys = {f"id:{party_id}" for party_id in (party.get("PartyId"), party.get("Id")) if party_id}
+        emails = [email.get("Address") for email in (party.get("Emails") or {}).get("$values", [])]
+        emails.append(party.get("Email"))
+        keys.update(f"email:{normalize_email(email)}" for email in emails if email)
+        return keys
+
+    def get_by_id(self, party_id):
+        return self._get(f"id:{party_id}") if party_id else None
+
+    def get_by_email(self, email):
+        return self._get(f"email:{normalize_email(email)}") if email else None
+
+    def _get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at < time.monotonic():
+                self._remove(entry)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            # Every key of the party, eviction goes by the oldest key
+            for entry_key in entry.keys:
+                self._entries.move_to_end(entry_key)
+            self.hits += 1
+            data = entry.data
+        return json.loads(data)
+
+    def put(self, party):
+        """Cache a Party document under its id(s) and email(s)."""
+        if not self.enabled or not isinstance(party, dict):
+            return
+        keys = self.party_keys(party)
+        if not keys:
+            return
+        data = json.dumps(party)
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            for key in keys:
+                previous = self._entries.get(key)
+                if previous is None:
+                    continue
+                if self._id_keys(previous.keys & keys):
+                    # An older copy of the same party
+                    self._remove(previous)
+                else:
+                    # Another party that had the email, it stays reachable by its other keys
+                    self._remove_keys(previous, previous.keys & keys)
+            entry = _CacheEntry(data, keys, time.monotonic() + self.ttl)
+            for key in keys:
+                self._entries[key] = entry
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, oldest = next(iter(self._entries.items()))
+                self._remove(oldest)
+
+    @staticmethod
+    def _id_keys(keys):
+        return {key for key in keys if key.startswith("id:")}
+
+    def _remove(self, entry):
+        for key in entry.keys:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+        self._size -= len(entry.data)
+
+    def _remove_keys(self, entry, keys):
+        for key in keys:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+        entry.keys = entry.keys - keys
+        if not entry.keys:
+            self._size -= len(entry.data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len({id(entry) for entry in self._entries.values()}),
+                "bytes": self._size,
+            }
+
+
+class NegativeCache:
+    """Bounded LRU set of lookup keys known to have no match, each remembered for `ttl` seconds.
+
+    It also counts the records failed for each key, so a run can report
+    them once per key rather than once per record.
+    """
+
+    def __init__(self, max_entries=10000, ttl=900):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.other_failures = 0
+        self._expiries = OrderedDict()
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.ttl > 0
+
+    def __contains__(self, key):
+        if not self.enabled or not key:
+            return False
+        with self._lock:
+            expires_at = self._expiries.get(key)
+            if expires_at is None:
+                return False
+            if expires_at < time.monotonic():
+                del self._expiries[key]
+                return False
+            self._expiries.move_to_end(key)
+            self.hits += 1
+            return True
+
+    def add(self, key):
+        if not self.enabled or not key:
+            return
+        with self._lock:
+            self._expiries[key] = time.monotonic() + self.ttl
+            self._expiries.move_to_end(key)
+            while len(self._expiries) > self.max_entries:
+                self._expiries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._expiries.pop(key, None)
+
+    def count_failure(self, key):
+        """Count a record failed for the key, keys past `max_entries` distinct ones are counted together."""
+        with self._lock:
+            if key in self._failures or len(self._failures) < max(self.max_entries, 1):
+                self._failures[key] = self._failures.get(key, 0) + 1
+            else:
+                self.other_failures += 1
+
+    def failures(self):
+        """Return the failed record counts by key, the most failed first."""
+        with self._lock:
+            return sorted(self._failures.items(), key=lambda item: item[1], reverse=True)
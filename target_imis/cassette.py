@@ -0,0 +1,134 @@
+"""Recording of the HTTP exchanges of a run, to replay them offline."""
+import http.client
+import json
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from target_imis.exceptions import CassetteMissError
+
+REDACTED = "<redacted>"
+# Response headers the target reads, the only ones recorded
+RECORDED_HEADERS = ("Content-Type", "Retry-After")
+# Secrets of a token response
+TOKEN_FIELDS = ("access_token", "refresh_token")
+
+
+def _path(url):
+    """Path and query of a URL, so a cassette replays against any host."""
+    parts = urlsplit(url)
+    return f"{parts.path}?{parts.query}" if parts.query else parts.path
+
+
+def _is_token_request(url):
+    return urlsplit(url).path.rstrip("/").lower().endswith("/token")
+
+
+def _body_text(body):
+    if body is None:
+        return None
+    return body.decode("utf-8", "replace") if isinstance(body, bytes) else str(body)
+
+
+class Cassette:
+    """JSON Lines file of request/response exchanges, with the time each one took.
+
+    In `record` mode every exchange is appended as it completes. In
+    `replay` mode requests are answered from the file, in recorded order,
+    by method, path, query and body, falling back to method, path and
+    query for bodies that vary between runs (e.g. timestamps). Each reply
+    takes its recorded time multiplied by `latency_scale`. Credentials and
+    tokens are never written to the file.
+    """
+
+    def __init__(self, path, mode, latency_scale=1.0):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._file = None
+        if mode == "record":
+            self._file = open(path, "w")
+        else:
+            self._load()
+
+    def _load(self):
+        self._by_body = {}
+        self._by_path = {}
+        with open(self.path) as cassette_file:
+            for line in cassette_file:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self._by_body.setdefault((entry["method"], entry["url"], entry["request_body"]), deque()).append(entry)
+                self._by_path.setdefault((entry["method"], entry["url"]), deque()).append(entry)
+
+    def record(self, response, seconds):
+        request = response.request
+        body = response.text
+        if _is_token_request(request.url):
+            request_body = REDACTED
+            try:
+                token = response.json()
+                body = json.dumps({key: REDACTED if key in TOKEN_FIELDS else value for key, value in token.items()})
+            except ValueError:
+                pass
+        else:
+            request_body = _body_text(request.body)
+        entry = {
+            "method": request.method,
+            "url": _path(request.url),
+            "request_body": request_body,
+            "status": response.status_code,
+            "headers": {key: response.headers[key] for key in RECORDED_HEADERS if key in response.headers},
+            "body": body,
+            "elapsed": round(seconds, 6),
+        }
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def _take(self, key, index):
+        entries = index.get(key)
+        while entries:
+            entry = entries.popleft()
+            if not entry.get("replayed"):
+                entry["replayed"] = True
+                return entry
+        return None
+
+    def replay(self, method, url, params=None, data=None):
+        """Return the recorded response of a request, after its recorded latency."""
+        prepared = requests.Request(method, url, params=params, data=data).prepare()
+        path = _path(prepared.url)
+        request_body = REDACTED if _is_token_request(prepared.url) else _body_text(prepared.body)
+        with self._lock:
+            entry = self._take((method, path, request_body), self._by_body) or self._take((method, path), self._by_path)
+        if entry is None:
+            raise CassetteMissError(f"No recorded response left for {method} {path}")
+        if self.latency_scale:
+            time.sleep(entry["elapsed"] * self.latency_scale)
+
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.reason = http.client.responses.get(entry["status"], "")
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response._content = (entry["body"] or "").encode("utf-8")
+        response.encoding = "utf-8"
+        response.url = prepared.url
+        response.request = prepared
+        response.elapsed = timedelta(seconds=entry["elapsed"])
+        return response
+
+    def close(self):
+        if self._file:
+            with self._lock:
+                self._file.close()
@@ -0,0 +1,70 @@
+"""Circuit breaker cutting retries short while iMIS fails a large share of the requests."""
+import threading
+import time
+from collections import deque
+
+import singer
+
+from target_imis.rate_limiter import THROTTLE_STATUS_CODES
+
+LOGGER = singer.get_logger()
+
+
+def is_server_error(status_code):
+    """Whether a status code is a failing request, as opposed to throttling or a success."""
+    return status_code is not None and status_code >= 500 and status_code not in THROTTLE_STATUS_CODES
+
+
+class CircuitBreaker:
+    """Error rate of the last `window` responses, shared by every sink.
+
+    The breaker opens once at least `min_requests` responses are known and
+    more than `error_rate` of them are server errors. While it's open,
+    requests failing with a server error are not retried, so records that
+    can't succeed fail fast instead of holding the run up in backoff. It
+    closes `cooldown` seconds later, starting again from an empty window.
+    """
+
+    def __init__(self, error_rate=0.5, min_requests=20, cooldown=60.0, window=100):
+        self.error_rate = error_rate
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+        self.trips = 0
+        self._outcomes = deque(maxlen=window)
+        self._errors = 0
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.error_rate > 0
+
+    @property
+    def is_open(self):
+        if self._open_until and time.monotonic() >= self._open_until:
+            with self._lock:
+                if self._open_until and time.monotonic() >= self._open_until:
+                    self._open_until = 0.0
+                    LOGGER.info("Circuit breaker closed, failing requests are retried again")
+        return bool(self._open_until)
+
+    def record(self, status_code):
+        if not self.enabled:
+            return
+        failed = is_server_error(status_code)
+        with self._lock:
+            if len(self._outcomes) == self._outcomes.maxlen:
+                self._errors -= self._outcomes[0]
+            self._outcomes.append(failed)
+            self._errors += failed
+            if self._open_until or len(self._outcomes) < self.min_requests:
+                return
+            if self._errors / len(self._outcomes) > self.error_rate:
+                self.trips += 1
+                self._open_until = time.monotonic() + self.cooldown
+                LOGGER.warning(
+                    f"Circuit breaker open: {self._errors} of the last {len(self._outcomes)} requests failed, "
+                    f"server errors are not retried for {self.cooldown:.0f}s"
+                )
+                self._outcomes.clear()
+                self._errors = 0
@@ -1,19 +1,63 @@
 from hotglue_singer_sdk.target_sdk.client import HotglueSink
+import backoff
+import json
+import os
 import requests
+import sys
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from functools import cached_property
 from hotglue_singer_sdk.plugin_base import PluginBase
+from hotglue_singer_sdk.target_sdk.common import HGJSONEncoder
 from typing import Dict, List, Optional
 import singer
 from hotglue_singer_sdk.exceptions import FatalAPIError, RetriableAPIError
+from hotglue_singer_sdk.helpers._network import giveup_oserror_not_transient_network
 from hotglue_etl_exceptions import InvalidPayloadError
+from target_imis.circuit_breaker import is_server_error
 from target_imis.exceptions import RetriableInvalidPayloadError
-from target_imis.auth import IMISAuth
+from target_imis.metrics import endpoint_label
 
 LOGGER = singer.get_logger()
 
+# Records buffered per batch when max_workers is set without an explicit batch_size
+DEFAULT_CONCURRENT_BATCH_SIZE = 100
+# Hashes of processed records remembered for deduplication when bookmark_window bounds the state
+DEFAULT_BOUNDED_DEDUPE_WINDOW = 100000
+# Work a sink running in parallel_streams queues ahead of its stream thread: records, or batches when buffering
+STREAM_QUEUE_RECORDS = 1000
+STREAM_QUEUE_BATCHES = 2
+
+
+def normalize_entity(value):
+    """Comparable form of an iMIS document: no `$type` metadata or null fields, `$values` collections unordered."""
+    if isinstance(value, dict):
+        normalized = {
+            key: normalize_entity(item)
+            for key, item in value.items()
+            if key != "$type" and item is not None
+        }
+        if isinstance(normalized.get("$values"), list):
+            normalized["$values"] = sorted(
+                normalized["$values"],
+                key=lambda item: json.dumps(item, sort_keys=True, default=str),
+            )
+        return normalized
+    if isinstance(value, list):
+        return [normalize_entity(item) for item in value]
+    return value
+
+
 class IMISSink(HotglueSink):
     """IMIS target sink class."""
-    
+
+    # Largest page size iMIS returns for a paged query
+    page_size = 500
+    # Values per multi-valued ("in:") Party query, keeps the URL short
+    lookup_chunk_size = 50
+
     def __init__(
         self,
         target: PluginBase,
@@ -22,7 +66,22 @@ class IMISSink(HotglueSink):
         key_properties: Optional[List[str]],
     ) -> None:
         super().__init__(target, stream_name, schema, key_properties)
-        self.__auth = IMISAuth(dict(self.config))
+        self.__auth = target.auth
+        self._buffered_records = []
+        self._deferred_states = threading.local()
+        self._states_by_hash = None
+        self._states_lock = threading.Lock()
+        self._spilled_bookmarks = 0
+        # Failed bookmarks kept at the start of the state's bookmarks when spilling, up to `bookmark_window`
+        self._retained_failures = 0
+        self._spilled_failures = 0
+        self._stream_futures = deque()
+        self._futures_lock = threading.Lock()
+        # Held while the buffer is filled or drained, the stream threads drain sinks too
+        self._drain_lock = threading.RLock()
+        self._retry_budget = threading.local()
+        # Records skipped for a hash already in the state, they get no bookmark
+        self.skipped_duplicates = 0
 
     @property
     def base_url(self):
@@ -31,6 +90,55 @@ class IMISSink(HotglueSink):
             site_url = f"https://{site_url}"
         return f"{site_url}/api/"
     
+    @property
+    def transport(self):
+        return self._target.transport
+
+    @property
+    def metrics(self):
+        return self._target.metrics
+
+    @property
+    def journal(self):
+        return self._target.journal
+
+    @property
+    def party_cache(self):
+        return self._target.party_cache
+
+    @property
+    def negative_cache(self):
+        return self._target.negative_cache
+
+    @property
+    def reference_data(self):
+        return self._target.reference_data
+
+    @property
+    def circuit_breaker(self):
+        return self._target.circuit_breaker
+
+    @property
+    def dead_letters(self):
+        return self._target.dead_letters
+
+    @property
+    def payload_error_max_tries(self):
+        """Attempts of a request iMIS fails with its generic error, which a bad payload gets on every try."""
+        return int(self.config.get("payload_error_max_tries") or 2)
+
+    @property
+    def pending_contacts(self):
+        return self._target.pending_contacts
+
+    @property
+    def identity_index(self):
+        return self._target.identity_index
+
+    @property
+    def identity_index_trust_seconds(self):
+        return float(self.config.get("identity_index_trust_seconds", 86400))
+
     @property
     def lookup_fields_dict(self):
         return self.config.get("lookup_fields") or {}
@@ -39,6 +147,507 @@ class IMISSink(HotglueSink):
     def lookup_method(self):
         return self.config.get("lookup_method") or "all"
 
+    @property
+    def skip_unchanged_records(self):
+        return self.config.get("skip_unchanged_records", True)
+
+    @property
+    def max_workers(self):
+        return int(self.config.get("max_workers") or 1)
+
+    @property
+    def parallel_streams(self):
+        return bool(self.config.get("parallel_streams", False))
+
+    @property
+    def batch_size(self):
+        default_batch_size = DEFAULT_CONCURRENT_BATCH_SIZE if self.max_workers > 1 else 1
+        return int(self.config.get("batch_size") or default_batch_size)
+
+    @property
+    def bookmark_window(self):
+        """Bookmarks kept in the state, older ones are spilled to `bookmark_spill_path`. 0 keeps them all."""
+        return int(self.config.get("bookmark_window") or 0)
+
+    @property
+    def dedupe_window(self):
+        default_dedupe_window = DEFAULT_BOUNDED_DEDUPE_WINDOW if self.bookmark_window else 0
+        return int(self.config.get("dedupe_window") or default_dedupe_window)
+
+    @cached_property
+    def bookmark_spill_path(self):
+        spill_path = self.config.get("bookmark_spill_path")
+        if spill_path:
+            return spill_path.format(stream=self.name)
+        return os.path.join(tempfile.gettempdir(), f"target-imis-{self.name}-bookmarks-{os.getpid()}.jsonl")
+
+    @property
+    def max_size(self):
+        return self.batch_size
+
+    @property
+    def current_size(self):
+        return len(self._buffered_records)
+
+    def process_record(self, record: dict, context: dict) -> None:
+        """Process the record, or buffer it until the batch is drained."""
+        # The SDK strips the externalId before preprocess_record, keep it for the identity index
+        external_id_key = self._target.EXTERNAL_ID_KEY
+        context["external_id"] = record.get(external_id_key) or record.get(external_id_key.lower())
+        if self.journal:
+            context["journal_key"] = self.journal.record_key(self.name, record)
+            context["journaled"], context["journaled_id"] = self.journal.get(context["journal_key"])
+        with self._drain_lock:
+            self.on_record_read(record, context)
+            if self.batch_size > 1:
+                self._buffered_records.append((record, context))
+                return
+        if not self.latest_state:
+            self.init_state()
+        self._run_in_stream(self._process_read_record, record, context)
+
+    def on_record_read(self, record: dict, context: dict) -> None:
+        """Hook run on the reading thread for every record, before it's processed or buffered."""
+        pass
+
+    def record_done(self, context: dict) -> None:
+        """Hook run once a record, and the records coalesced into it, are processed."""
+        pass
+
+    def _process_read_record(self, record, context):
+        self._process_one_record(record, context)
+        self._target.log_progress()
+
+    def process_batch(self, context: dict) -> None:
+        """Process the buffered records, concurrently when `max_workers` allows it."""
+        buffered_records, self._buffered_records = self._buffered_records, []
+        if not buffered_records:
+            return
+        if not self.latest_state:
+            self.init_state()
+        self._run_in_stream(self._process_buffered_records, buffered_records)
+
+    def _process_buffered_records(self, buffered_records):
+        buffered_records = self.coalesce_records(buffered_records)
+        self.prepare_batch([record for record, record_context in buffered_records if not record_context.get("journaled")])
+        try:
+            indexed_records = [(index, record, record_context) for index, (record, record_context) in enumerate(buffered_records)]
+            if self.max_workers <= 1:
+                state_updates = self._process_record_group(indexed_records)
+            else:
+                futures = [
+                    self.executor.submit(self._process_record_group, [indexed_records[index] for index in group])
+                    for group in self.group_records([record for record, _ in buffered_records])
+                ]
+                state_updates = {}
+                for future in futures:
+                    state_updates.update(future.result())
+            # Report states in arrival order, whatever order the workers finished in
+            for index in sorted(state_updates):
+                for args, kwargs in state_updates[index]:
+                    self._report_state(buffered_records[index][1], *args, **kwargs)
+        finally:
+            self.finish_batch()
+            for _, record_context in buffered_records:
+                self.record_done(record_context)
+        self._target.log_progress()
+
+    @cached_property
+    def stream_executor(self):
+        return ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{self.name}-stream")
+
+    @cached_property
+    def _stream_slots(self):
+        return threading.BoundedSemaphore(STREAM_QUEUE_BATCHES if self.batch_size > 1 else STREAM_QUEUE_RECORDS)
+
+    def _run_in_stream(self, func, *args):
+        """Run the sink's work inline, or queue it on the sink's own thread with `parallel_streams`."""
+        if not self.parallel_streams:
+            func(*args)
+            return
+        # Bounded, so reading the input doesn't run ahead of a slow stream
+        self._stream_slots.acquire()
+        try:
+            future = self.stream_executor.submit(func, *args)
+        except BaseException:
+            self._stream_slots.release()
+            raise
+        future.add_done_callback(lambda _: self._stream_slots.release())
+        self._stream_futures.append(future)
+        # Errors the stream thread ran into stop the run, as they would sequentially
+        while True:
+            with self._futures_lock:
+                if not self._stream_futures or not self._stream_futures[0].done():
+                    return
+                future = self._stream_futures.popleft()
+            future.result()
+
+    def wait_for_stream(self) -> None:
+        """Wait for the work queued on the sink's thread."""
+        while True:
+            with self._futures_lock:
+                if not self._stream_futures:
+                    return
+                future = self._stream_futures.popleft()
+            future.result()
+
+    def _report_state(self, context, state, *args, **kwargs):
+        """Report a record's state, and a copy of it for every record coalesced into it."""
+        coalesced_contexts = context.get("coalesced_contexts") or []
+        # update_state consumes some flags of the state it gets, copy it beforehand
+        coalesced_states = [dict(state) for _ in coalesced_contexts]
+        self._append_state(state, *args, **kwargs)
+        for coalesced_context, coalesced_state in zip(coalesced_contexts, coalesced_states):
+            coalesced_state.pop("hash", None)
+            coalesced_state.pop("externalId", None)
+            if coalesced_context.get("external_id"):
+                coalesced_state["externalId"] = coalesced_context["external_id"]
+            coalesced_state["coalesced"] = True
+            self._append_state(coalesced_state, *args, **kwargs)
+
+    @cached_property
+    def executor(self):
+        return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"{self.name}-worker")
+
+    def _process_record_group(self, group):
+        """Process records that share a key one after the other, collecting their state updates."""
+        state_updates = {}
+        for index, record, context in group:
+            self._deferred_states.updates = state_updates[index] = []
+            try:
+                self._process_one_record(record, context)
+            finally:
+                self._deferred_states.updates = None
+        return state_updates
+
+    def _process_one_record(self, record, context):
+        try:
+            if context.get("journaled"):
+                self._process_journaled_record(context)
+                return
+            error = self.get_fast_failure(record)
+            if error:
+                state = self._build_record_error_state(error, record=record, external_id=context.get("external_id"))
+                # Counted and reported once per cause at the end of the run, not logged per record
+                state["_fast_failed"] = True
+                self.update_state(state)
+                return
+            self._write_record(record, context)
+        finally:
+            self.record_done(context)
+
+    def get_fast_failure(self, record):
+        """Return the error a record is known to fail with before it's processed, if any."""
+        return None
+
+    def _process_journaled_record(self, context):
+        """Report a record a previous run committed, as an existing record."""
+        state = {"success": True, "journaled": True}
+        if context.get("journaled_id"):
+            state["id"] = context["journaled_id"]
+        if context.get("external_id"):
+            state["externalId"] = context["external_id"]
+        self.update_state(state, is_duplicate=True)
+
+    def _write_record(self, record, context):
+        """Preprocess and upsert a record, as HotglueSink.process_record does.
+
+        The time spent building the payload and writing it is recorded per
+        stream, and the upsert's outcome is journaled for every input record
+        it stands for.
+        """
+        snapshot_field_values = context.pop(self.TARGET_STATE_FIELD_VALUES_CONTEXT_KEY, None)
+        if snapshot_field_values is None and self._target_state_fields:
+            snapshot_field_values = self.capture_target_state_field_values(record)
+        external_id = None
+        external_id_key = self._target.EXTERNAL_ID_KEY
+
+        try:
+            if self.name not in self.allows_externalid and (record.get(external_id_key) or record.get(external_id_key.lower())):
+                external_id = record.pop(external_id_key, None) or record.pop(external_id_key.lower(), None)
+
+            with self.metrics.timer(f"{self.name} preprocess_record"):
+                record = self.preprocess_record(record, context)
+
+            if record and external_id:
+                record[external_id_key] = external_id
+        except Exception as e:
+            self.logger.exception(f"Preprocess record error {str(e)}")
+            self.update_state(self._build_record_error_state(e, record=record, external_id=external_id), record=record)
+            return
+
+        record_hash = self.build_record_hash(record)
+
+        if record_hash in self.processed_hashes:
+            self.logger.debug("Record of type %s already exists with hash: %s", self.name, record_hash)
+            with self._states_lock:
+                self.skipped_duplicates += 1
+            return
+
+        existing_state = self.get_existing_state(record_hash)
+
+        if self.name in self.allows_externalid:
+            external_id = record.get(external_id_key) or record.get(external_id_key.lower())
+        else:
+            external_id = record.pop(external_id_key, None) or record.pop(external_id_key.lower(), None)
+
+        if existing_state:
+            return self.update_state(existing_state, is_duplicate=True, record=record)
+
+        try:
+            with self.metrics.timer(f"{self.name} upsert_record"):
+                id, success, state_updates = self.upsert_record(record, context)
+        except Exception as e:
+            self._journal_outcome(context, None, False)
+            self.logger.exception(f"Upsert record error {str(e)}")
+            self.update_state(
+                self._build_record_error_state(e, record=record, external_id=external_id, record_hash=record_hash),
+                record=record,
+            )
+            return
+        self._journal_outcome(context, id, success)
+
+        if success:
+            self.logger.debug("%s processed id: %s", self.name, id)
+
+        state = {"success": success, "hash": record_hash}
+        if id:
+            state["id"] = id
+        if external_id:
+            state["externalId"] = external_id
+
+        is_duplicate = bool(state_updates.pop("existing", False))
+        if state_updates and isinstance(state_updates, dict):
+            state = dict(state, **state_updates)
+
+        self.update_state(state, is_duplicate=is_duplicate, record=record, snapshot_field_values=snapshot_field_values)
+
+    def _journal_outcome(self, context, id, success):
+        if not self.journal:
+            return
+        for record_context in [context] + context.get("coalesced_contexts", []):
+            if record_context.get("journal_key"):
+                self.journal.append(record_context["journal_key"], id, success)
+
+    def update_state(self, *args, **kwargs) -> None:
+        deferred_updates = getattr(self._deferred_states, "updates", None)
+        if deferred_updates is not None:
+            # Indexed right away, so a later copy of the record in the batch is a duplicate
+            self._index_state(*args, **kwargs)
+            deferred_updates.append((args, kwargs))
+            return
+        self._append_state(*args, **kwargs)
+
+    def _append_state(self, state, is_duplicate=False, **kwargs):
+        """Add a record's state to the bookmarks, the hash index and, past the bookmark window, the spill file."""
+        if is_duplicate:
+            self._append_duplicate_state(state, **kwargs)
+        else:
+            super().update_state(state, is_duplicate=is_duplicate, **kwargs)
+        self._index_state(state, is_duplicate)
+        self._spill_bookmarks()
+
+    def _append_duplicate_state(self, state, record=None, **kwargs):
+        """HotglueSink.update_state for a duplicate, counted in the progress line rather than logged at INFO."""
+        self.logger.debug("Record of type %s already exists with id: %s", self.name, state.get("id"))
+        self.latest_state["summary"][self.name]["existing"] += 1
+        if record and os.getenv("OUTPUT_MAPPED_RECORD", "false").lower() == "true":
+            state["mapped_record"] = record
+        self.latest_state["bookmarks"][self.name].append(state)
+
+    def _index_state(self, state, is_duplicate=False, **kwargs):
+        if is_duplicate or not state.get("success") or not state.get("hash"):
+            return
+        with self._states_lock:
+            states_by_hash = self._get_states_by_hash()
+            states_by_hash[state["hash"]] = state
+            if self.dedupe_window and len(states_by_hash) > self.dedupe_window:
+                states_by_hash.popitem(last=False)
+
+    def init_state(self):
+        # The SDK's processed_hashes is a class-level list, shared by every sink and scanned per record
+        self.processed_hashes = []
+        super().init_state()
+        self.processed_hashes = set(self.processed_hashes)
+
+    def _get_states_by_hash(self):
+        if self._states_by_hash is None:
+            self._states_by_hash = OrderedDict(
+                (state["hash"], state)
+                for state in self.latest_state["bookmarks"][self.name]
+                if state.get("success") and state.get("hash")
+            )
+        return self._states_by_hash
+
+    def get_existing_state(self, hash: str):
+        """Return the state of an earlier successful record with the same hash, from an index rather than a scan."""
+        with self._states_lock:
+            states_by_hash = self._get_states_by_hash()
+            state = states_by_hash.get(hash)
+            if state is not None:
+                states_by_hash.move_to_end(hash)
+        return state
+
+    def _spill_bookmarks(self) -> None:
+        """Move the bookmarks past twice the window to the spill file, keeping the newest `bookmark_window`.
+
+        Up to `bookmark_window` failed bookmarks stay in the state, ahead of
+        the newer ones, so the records that need attention are still reported
+        downstream. Failures past that cap are spilled with the successes.
+        """
+        if not self.bookmark_window:
+            return
+        bookmarks = self.latest_state["bookmarks"][self.name]
+        start = self._retained_failures
+        if len(bookmarks) - start < 2 * self.bookmark_window:
+            return
+        end = len(bookmarks) - self.bookmark_window
+        failed = [index for index in range(start, end) if not bookmarks[index].get("success")]
+        retained = set(failed[:self.bookmark_window - self._retained_failures])
+        spilled = [bookmarks[index] for index in range(start, end) if index not in retained]
+        # A new run starts a new spill file
+        with open(self.bookmark_spill_path, "a" if self._spilled_bookmarks else "w") as spill_file:
+            spill_file.writelines(json.dumps(state, cls=HGJSONEncoder) + "\n" for state in spilled)
+        bookmarks[start:end] = [bookmarks[index] for index in sorted(retained)]
+        self._retained_failures += len(retained)
+        self._spilled_bookmarks += len(spilled)
+        self._spilled_failures += len(failed) - len(retained)
+        summary = self.latest_state["summary"][self.name]
+        summary["spilled_bookmarks"] = self._spilled_bookmarks
+        summary["bookmarks_path"] = self.bookmark_spill_path
+        if self._spilled_failures:
+            summary["spilled_failures"] = self._spilled_failures
+
+    def coalesce_records(self, buffered_records: List[tuple]) -> List[tuple]:
+        """Hook to merge buffered (record, context) pairs that write the same remote entity.
+
+        A merged record's context lists the contexts of the records folded
+        into it under `coalesced_contexts`, each of them gets a copy of its state.
+        """
+        return buffered_records
+
+    def get_record_keys(self, record: dict) -> set:
+        """Keys of the remote entity a record writes to, records sharing a key are never processed concurrently."""
+        return set()
+
+    def group_records(self, records: List[dict]) -> List[List[int]]:
+        """Group record indexes so records sharing any key land in the same group, in arrival order."""
+        groups = []
+        group_keys = []
+        group_of_key = {}
+        for index, record in enumerate(records):
+            # Copies of a record run one after the other, so the later ones are found as duplicates
+            keys = self.get_record_keys(record) | {("record", self.build_record_hash(record))}
+            group_ids = sorted({group_of_key[key] for key in keys if key in group_of_key})
+            if not group_ids:
+                group_id = len(groups)
+                groups.append([])
+                group_keys.append(set())
+            else:
+                group_id = group_ids[0]
+                for other_id in group_ids[1:]:
+                    groups[group_id].extend(groups[other_id])
+                    group_keys[group_id].update(group_keys[other_id])
+                    for key in group_keys[other_id]:
+                        group_of_key[key] = group_id
+                    groups[other_id] = None
+            groups[group_id].append(index)
+            group_keys[group_id].update(keys)
+            for key in keys:
+                group_of_key[key] = group_id
+        return [sorted(group) for group in groups if group]
+
+    def clean_up(self) -> None:
+        if "stream_executor" in self.__dict__:
+            self.wait_for_stream()
+            self.stream_executor.shutdown()
+        if "executor" in self.__dict__:
+            self.executor.shutdown()
+        super().clean_up()
+
+    def prepare_batch(self, records: List[dict]) -> None:
+        """Hook to resolve anything the buffered records share before processing."""
+        pass
+
+    def finish_batch(self) -> None:
+        """Hook to release per-batch data once the buffered records are processed."""
+        pass
+
+    def _request(
+        self, http_method, endpoint, params=None, request_data=None, headers=None, verify=True
+    ) -> requests.Response:
+        """Send a request through the shared transport."""
+        headers = dict(headers or {}, **self.default_headers)
+        headers["Content-Type"] = "application/json"
+        params = dict(params or {}, **self.params)
+        data = (
+            json.dumps(request_data, cls=HGJSONEncoder)
+            if request_data
+            else None
+        )
+
+        response = self.transport.request(
+            http_method,
+            self.url(endpoint),
+            params=params,
+            headers=headers,
+            data=data,
+            verify=verify,
+            timeout=self.timeout,
+        )
+        self.circuit_breaker.record(response.status_code)
+        self.validate_response(response)
+        return response
+
+    def request_decorator(self, func):
+        decorated = backoff.on_exception(
+            self.backoff_wait_generator,
+            self.backoff_exceptions(),
+            max_tries=self.backoff_max_tries,
+            on_backoff=self.backoff_handler,
+            giveup=self.giveup,
+        )(func)
+
+        def request(*args, **kwargs):
+            self._retry_budget.payload_errors = 0
+            return decorated(*args, **kwargs)
+
+        return request
+
+    def giveup(self, error: Exception) -> bool:
+        """Whether a failed request is not retried, on top of the backoff's try limit."""
+        if giveup_oserror_not_transient_network(error):
+            return True
+        if isinstance(error, RetriableInvalidPayloadError):
+            self._retry_budget.payload_errors = getattr(self._retry_budget, "payload_errors", 0) + 1
+            if self._retry_budget.payload_errors >= self.payload_error_max_tries:
+                return True
+        # While the breaker is open, server errors fail the record at once
+        response = getattr(error, "response", None)
+        return response is not None and is_server_error(response.status_code) and self.circuit_breaker.is_open
+
+    def backoff_handler(self, details: dict) -> None:
+        """Count the retry, by endpoint and exception class."""
+        method, endpoint = (list(details.get("args", ())) + [None, None])[:2]
+        method = details.get("kwargs", {}).get("http_method", method)
+        endpoint = details.get("kwargs", {}).get("endpoint", endpoint)
+        # Older backoff releases don't pass the exception, the handler runs while it's being handled
+        error = details.get("exception") or sys.exc_info()[1]
+        self.metrics.count_retry(endpoint_label(method, self.url(endpoint or "")), error)
+
+    def _build_record_error_state(self, error: Exception, **kwargs) -> dict:
+        self.metrics.count_error(self.name, error)
+        if self.dead_letters:
+            self.dead_letters.append(self.name, error, record=kwargs.get("record"), external_id=kwargs.get("external_id"))
+        return super()._build_record_error_state(error, **kwargs)
+
+    def process_error_state(self, state: dict):
+        if state.pop("_fast_failed", False):
+            LOGGER.debug("Failed %s record without processing it: %s", self.name, state.get("error"))
+            state["error"] = self.error_to_string(state.get("error"))
+            return state
+        return super().process_error_state(state)
+
     def validate_response(self, response: requests.Response) -> None:
         """Validate HTTP response."""
         if response.status_code in [409]:
@@ -63,20 +672,83 @@ class IMISSink(HotglueSink):
                 raise InvalidPayloadError(error_message)
             raise FatalAPIError(msg)
         
+    @staticmethod
+    def get_party_values(party, key):
+        """Return the normalized values a Party holds for a lookup query key."""
+        if key == "id":
+            values = [party.get("PartyId"), party.get("Id")]
+        elif key == "email":
+            values = [email.get("Address") for email in party.get("Emails", {}).get("$values", [])]
+            values.append(party.get("Email"))
+        elif key == "firstname":
+            values = [party.get("PersonName", {}).get("FirstName")]
+        elif key == "lastname":
+            values = [party.get("PersonName", {}).get("LastName")]
+        else:
+            values = []
+        return {str(value).strip().lower() for value in values if value}
+
+    def get_paged_items(self, endpoint, params=None):
+        """Yield the items of every page of a paged iMIS query."""
+        offset = 0
+        while True:
+            search_response = self.request_api(
+                "GET",
+                endpoint=endpoint,
+                params=dict(params or {}, limit=self.page_size, offset=offset),
+                headers=self.prepare_request_headers(),
+            ).json()
+            yield from search_response["Items"]["$values"]
+            if not search_response.get("HasNext"):
+                return
+            offset = search_response.get("NextOffset") or offset + len(search_response["Items"]["$values"])
+
+    def search_parties(self, key, values):
+        """Find every Party whose `key` matches one of `values`, with paged multi-valued queries."""
+        values = list(values)
+        parties = []
+        for start in range(0, len(values), self.lookup_chunk_size):
+            chunk = values[start:start + self.lookup_chunk_size]
+            for party in self.get_paged_items("Party", {key: f"in:{'|'.join(chunk)}"}):
+                self.party_cache.put(party)
+                parties.append(party)
+        return parties
+
+    def get_party_by_id(self, party_id):
+        """Fetch a Party (person or organization) by id."""
+        cached_party = self.party_cache.get_by_id(party_id)
+        if cached_party:
+            return cached_party
+
+        LOGGER.debug("Getting party by id: %s", party_id)
+        search_response = self.request_api(
+            "GET",
+            endpoint=f"Party?id={party_id}",
+            headers=self.prepare_request_headers(),
+        )
+        LOGGER.debug("Response Status: %s", search_response.status_code)
+        search_response = search_response.json()
+
+        if search_response["Items"]["$values"]:
+            self.party_cache.put(search_response["Items"]["$values"][0])
+            return search_response["Items"]["$values"][0]
+        return None
+
+    def get_address_purposes(self):
+        response = self.request_api("GET", endpoint="AddressPurpose", headers=self.prepare_request_headers())
+        address_purposes = response.json().get("Items", {}).get("$values", [])
+        if not isinstance(address_purposes, list):
+            raise FatalAPIError(f"Address purposes is not a list: {address_purposes}")
+        return address_purposes
+
     @cached_property
     def default_address_purpose(self):
-        default_address_path = f"{self.base_url}AddressPurpose"
-        response = requests.get(default_address_path, headers=self.prepare_request_headers())
-        self.validate_response(response)
-
-        address_purposes = response.json().get("Items", []).get("$values", [])
+        address_purposes = self.reference_data.get("AddressPurpose", self.get_address_purposes)
 
         if not address_purposes:
             self.logger.warning("No address purposes found, using 'Address'")
             return "Address"
-        if not isinstance(address_purposes, list):
-            raise FatalAPIError(f"Address purposes is not a list: {address_purposes}")
-        
+
         default_address_purpose = next((ap for ap in address_purposes if ap.get("IsDefaultAddress")), None)
         if not default_address_purpose:
             self.logger.warning("No default address purpose found, using 'Address'")
@@ -0,0 +1,40 @@
+"""Spool of the records a run failed to write, to replay them later."""
+import json
+import os
+import threading
+
+from hotglue_singer_sdk.target_sdk.common import HGJSONEncoder
+
+# Characters of a failed response's body kept in the spool
+RESPONSE_TEXT_LIMIT = 2000
+
+
+class DeadLetterSpool:
+    """JSON Lines file of failed records: stream, error class and message, response and payload."""
+
+    def __init__(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        self._file = open(path, "a")
+
+    def append(self, stream, error, record=None, external_id=None):
+        entry = {"stream": stream, "error_class": type(error).__name__, "error": str(error)}
+        if external_id:
+            entry["externalId"] = external_id
+        response = getattr(error, "response", None)
+        if response is not None:
+            entry["status_code"] = response.status_code
+            entry["response"] = response.text[:RESPONSE_TEXT_LIMIT]
+        entry["record"] = record
+        line = json.dumps(entry, cls=HGJSONEncoder, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
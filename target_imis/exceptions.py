@@ -2,4 +2,10 @@ from hotglue_singer_sdk.exceptions import RetriableAPIError
 from hotglue_etl_exceptions import InvalidPayloadError
 
 class RetriableInvalidPayloadError(RetriableAPIError, InvalidPayloadError):
-    pass
\ No newline at end of file
+    pass
+
+class UnknownContactError(InvalidPayloadError):
+    pass
+
+class CassetteMissError(Exception):
+    pass
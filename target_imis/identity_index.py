@@ -0,0 +1,90 @@
+"""Persistent index of the iMIS PartyIds behind emails and externalIds."""
+import os
+import sqlite3
+import threading
+import time
+
+from target_imis.cache import normalize_email
+
+# Writes kept in the open transaction before they are committed to disk
+COMMIT_EVERY = 100
+
+
+class IdentityIndex:
+    """SQLite-backed map of (normalized email | externalId) -> PartyId, scoped per iMIS site.
+
+    Entries carry the time they were last confirmed, so callers can decide
+    how long to trust them before verifying them against iMIS again.
+    """
+
+    def __init__(self, path, site):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.site = site
+        self._pending_writes = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS identities (
+                site TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                value TEXT NOT NULL,
+                party_id TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (site, kind, value)
+            )
+            """
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS identities_party_id ON identities (site, party_id)"
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def _normalize(kind, value):
+        return normalize_email(value) if kind == "email" else str(value)
+
+    def get(self, kind, value):
+        """Return `(party_id, age_in_seconds)` for an email or externalId, or None."""
+        if not value:
+            return None
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT party_id, updated_at FROM identities WHERE site = ? AND kind = ? AND value = ?",
+                (self.site, kind, self._normalize(kind, value)),
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], time.time() - row[1]
+
+    def put(self, kind, value, party_id):
+        if not value or not party_id:
+            return
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO identities (site, kind, value, party_id, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (self.site, kind, self._normalize(kind, value), str(party_id), time.time()),
+            )
+            self._after_write()
+
+    def discard(self, kind, value):
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM identities WHERE site = ? AND kind = ? AND value = ?",
+                (self.site, kind, self._normalize(kind, value)),
+            )
+            self._after_write()
+
+    def _after_write(self):
+        self._pending_writes += 1
+        if self._pending_writes >= COMMIT_EVERY:
+            self._connection.commit()
+            self._pending_writes = 0
+
+    def close(self):
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
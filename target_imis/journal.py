@@ -0,0 +1,122 @@
+"""Write-ahead journal of the records a run has written to iMIS."""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+import singer
+
+LOGGER = singer.get_logger()
+
+# Journal lines written between two fsyncs, every line is flushed to the OS as it is written
+FSYNC_EVERY = 100
+
+
+class Journal:
+    """Append-only JSON Lines log of upsert outcomes, keyed by a hash of the raw input record.
+
+    A run reads the journal left by previous runs, so the records they
+    committed can be skipped without contacting iMIS. Keys are scoped to
+    the iMIS site, so a journal never applies to another site.
+
+    The committed keys are looked up in an SQLite index next to the
+    journal, `path`.index, rather than held in memory. The index remembers
+    how much of the journal it covers, so a run only replays the lines
+    written after it, and rebuilds it when the journal was replaced.
+    """
+
+    def __init__(self, path, site):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.site = site
+        self._pending_syncs = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(f"{path}.index", check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS committed (key TEXT PRIMARY KEY, id TEXT)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS indexed (journal_inode INTEGER NOT NULL, journal_offset INTEGER NOT NULL)"
+        )
+        self._offset = self._load()
+        self._file = open(path, "a")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            open(self.path, "a").close()
+        stat = os.stat(self.path)
+        row = self._connection.execute("SELECT journal_inode, journal_offset FROM indexed").fetchone()
+        inode, offset = row if row else (None, 0)
+        if inode != stat.st_ino or offset > stat.st_size:
+            # Another journal than the one indexed
+            self._connection.execute("DELETE FROM committed")
+            offset = 0
+        self._inode = stat.st_ino
+        size = stat.st_size
+        if offset < size:
+            with open(self.path, "rb") as journal_file:
+                journal_file.seek(offset)
+                for line in journal_file:
+                    if not line.endswith(b"\n"):
+                        # A run killed mid-write leaves a partial last line
+                        break
+                    offset += len(line)
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._index(entry["key"], entry.get("id"), entry.get("success"))
+        self._connection.execute("DELETE FROM indexed")
+        self._connection.execute("INSERT INTO indexed (journal_inode, journal_offset) VALUES (?, ?)", (self._inode, offset))
+        self._connection.commit()
+        count = self._connection.execute("SELECT COUNT(*) FROM committed").fetchone()[0]
+        LOGGER.info(f"Loaded {count} committed records from the journal")
+        return size
+
+    def _index(self, key, id, success):
+        if success:
+            self._connection.execute("INSERT OR REPLACE INTO committed (key, id) VALUES (?, ?)", (key, json.dumps(id)))
+        else:
+            self._connection.execute("DELETE FROM committed WHERE key = ?", (key,))
+
+    def record_key(self, stream, record):
+        """Key of a raw input record, stable across runs."""
+        payload = json.dumps([self.site, stream, record], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key):
+        """Return `(True, id)` when the record was committed by a run, else `(False, None)`."""
+        with self._lock:
+            row = self._connection.execute("SELECT id FROM committed WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return False, None
+        return True, json.loads(row[0])
+
+    def append(self, key, id, success):
+        line = json.dumps({"key": key, "id": id, "success": bool(success)}) + "\n"
+        with self._lock:
+            if success:
+                self._index(key, id, success)
+            self._file.write(line)
+            self._file.flush()
+            self._offset += len(line.encode())
+            self._pending_syncs += 1
+            if self._pending_syncs >= FSYNC_EVERY:
+                os.fsync(self._file.fileno())
+                self._sync_index()
+
+    def _sync_index(self):
+        # Only lines already on disk are marked indexed, a crash replays the others
+        self._connection.execute("UPDATE indexed SET journal_offset = ?", (self._offset,))
+        self._connection.commit()
+        self._pending_syncs = 0
+
+    def close(self):
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._sync_index()
+            self._file.close()
+            self._connection.close()
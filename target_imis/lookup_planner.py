@@ -0,0 +1,80 @@
+"""Planner of the searches of the sequential contact lookup."""
+import threading
+
+# Lookup fields in the order they narrow a Party search the most
+SELECTIVE_FIELDS = ["id", "email", "last_name", "first_name"]
+# Fields identifying a contact on their own, always tried before the others
+IDENTIFYING_FIELDS = ("id", "email")
+# Ambiguous searches of a field before its ambiguity rate is trusted
+MIN_AMBIGUOUS_SEARCHES = 3
+
+
+class LookupPlanner:
+    """Order in which the sequential lookup tries a record's fields, learned over the run.
+
+    The identifying fields are tried before the others, so a name never
+    binds a record its id or email would have matched to another contact.
+    Within each group, fields are tried by their hit rate so far, the most
+    selective first while the rates are even. A field whose searches mostly match several
+    contacts is searched together with the fields tried after it, in one
+    AND query, rather than alone.
+    """
+
+    def __init__(self, ambiguity_rate=0.5):
+        self.ambiguity_rate = ambiguity_rate
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _field_stats(self, field):
+        return self._stats.setdefault(field, {"searches": 0, "hits": 0, "single_searches": 0, "ambiguous": 0})
+
+    def _rank(self, field):
+        stats = self._field_stats(field)
+        selectivity = SELECTIVE_FIELDS.index(field) if field in SELECTIVE_FIELDS else len(SELECTIVE_FIELDS)
+        # Smoothed, so a field without searches yet starts at even odds
+        return field not in IDENTIFYING_FIELDS, -(stats["hits"] + 1) / (stats["searches"] + 2), selectivity
+
+    def is_ambiguous(self, field):
+        with self._lock:
+            stats = self._field_stats(field)
+            return (
+                stats["ambiguous"] >= MIN_AMBIGUOUS_SEARCHES
+                and stats["ambiguous"] / stats["single_searches"] >= self.ambiguity_rate
+            )
+
+    def order(self, fields):
+        """Return the fields in the order to try them."""
+        with self._lock:
+            return sorted(fields, key=self._rank)
+
+    def plan(self, fields):
+        """Return the searches to try for a record with values for `fields`, as tuples of fields to AND."""
+        ordered_fields = self.order(fields)
+        steps = []
+        for position, field in enumerate(ordered_fields):
+            later_fields = ordered_fields[position + 1:]
+            if later_fields and self.is_ambiguous(field):
+                steps.append((field, *later_fields))
+            else:
+                steps.append((field,))
+        return steps
+
+    def record(self, step, matched, ambiguous=False):
+        """Count the outcome of a search, under the first field of its step."""
+        with self._lock:
+            stats = self._field_stats(step[0])
+            stats["searches"] += 1
+            stats["hits"] += bool(matched)
+            # Only a field searched alone tells whether it's ambiguous
+            if len(step) == 1:
+                stats["single_searches"] += 1
+                stats["ambiguous"] += bool(ambiguous)
+
+    def summary(self):
+        with self._lock:
+            return ", ".join(
+                f"{field} {stats['hits']}/{stats['searches']} hits"
+                + (f" ({stats['ambiguous']} ambiguous)" if stats["ambiguous"] else "")
+                for field, stats in self._stats.items()
+                if stats["searches"]
+            )
@@ -0,0 +1,137 @@
+"""Mapping of Singer records to iMIS data contracts."""
+import time
+from datetime import datetime
+
+PERSON_DATA = "Asi.Soa.Membership.DataContracts.PersonData, Asi.Contracts"
+PERSON_NAME_DATA = "Asi.Soa.Membership.DataContracts.PersonNameData, Asi.Contracts"
+EMAIL_DATA_COLLECTION = "Asi.Soa.Membership.DataContracts.EmailDataCollection, Asi.Contracts"
+EMAIL_DATA = "Asi.Soa.Membership.DataContracts.EmailData, Asi.Contracts"
+PHONE_DATA_COLLECTION = "Asi.Soa.Membership.DataContracts.PhoneDataCollection, Asi.Contracts"
+PHONE_DATA = "Asi.Soa.Membership.DataContracts.PhoneData, Asi.Contracts"
+FULL_ADDRESS_DATA_COLLECTION = "Asi.Soa.Membership.DataContracts.FullAddressDataCollection, Asi.Contracts"
+FULL_ADDRESS_DATA = "Asi.Soa.Membership.DataContracts.FullAddressData, Asi.Contracts"
+ADDRESS_DATA = "Asi.Soa.Membership.DataContracts.AddressData, Asi.Contracts"
+PRIMARY_ORGANIZATION_DATA = "Asi.Soa.Membership.DataContracts.PrimaryOrganizationInformationData, Asi.Contracts"
+GENERIC_ENTITY_DATA = "Asi.Soa.Core.DataContracts.GenericEntityData, Asi.Contracts"
+
+# Record field -> Activity property
+DEFAULT_ACTIVITY_FIELD_MAPPINGS = {
+    "id": "ID",
+    "activity_datetime": "ACTIVITY_DATE",
+    "duration_seconds": "DURATION",
+    "contact_id": "CONTACT_ID",
+    "company_id": "COMPANY_ID",
+    "deal_id": "DEAL_ID",
+    "owner_id": "OWNER_ID",
+    "type": "ACTIVITY_TYPE",
+    "title": "TITLE",
+    "description": "DESCRIPTION",
+    "note": "NOTE",
+    "location": "LOCATION",
+    "status": "STATUS",
+    "start_datetime": "START_DATE",
+    "end_datetime": "END_DATE",
+}
+# TRANSACTION_DATE is the time of the upload in the organization's timezone
+DEFAULT_ACTIVITY_TIMEZONE = "America/Toronto"
+
+# Record address field -> AddressData field
+ADDRESS_FIELDS = (
+    ("city", "CityName"),
+    ("postal_code", "PostalCode"),
+    ("state", "RegionName"),
+    ("country", "CountryCode"),
+)
+
+# Record fields a contact upsert writes
+CONTACT_FIELDS = ("first_name", "last_name", "email", "company_id", "phone_numbers", "addresses")
+
+
+def collection(type_name, values=None):
+    return {"$type": type_name, "$values": values if values is not None else []}
+
+
+def email_data(address, email_type, is_primary):
+    return {"$type": EMAIL_DATA, "Address": address, "EmailType": email_type, "IsPrimary": is_primary}
+
+
+def phone_data(number, phone_type):
+    return {"$type": PHONE_DATA, "Number": number, "PhoneType": phone_type}
+
+
+def full_address_data(address, address_purpose):
+    address_data = {"$type": ADDRESS_DATA, "AddressLines": [address.get("line1")]}
+    for field, address_field in ADDRESS_FIELDS:
+        address_data[address_field] = address.get(field)
+    return {"$type": FULL_ADDRESS_DATA, "AddressPurpose": address_purpose, "Address": address_data}
+
+
+def _has_address(address):
+    lines = address.get("AddressLines") or []
+    if isinstance(lines, dict):
+        lines = lines.get("$values") or []
+    return any(lines) or any(address.get(address_field) for _, address_field in ADDRESS_FIELDS)
+
+
+def filled_contact_fields(party):
+    """Return the CONTACT_FIELDS a PersonData document already holds a value for."""
+    person_name = party.get("PersonName") or {}
+    filled = {
+        "first_name": person_name.get("FirstName"),
+        "last_name": person_name.get("LastName"),
+        "email": any(email.get("Address") for email in (party.get("Emails") or {}).get("$values", [])),
+        "company_id": (party.get("PrimaryOrganization") or {}).get("OrganizationPartyId"),
+        "phone_numbers": any(phone.get("Number") for phone in (party.get("Phones") or {}).get("$values", [])),
+        # Without addresses, iMIS returns one with empty fields
+        "addresses": any(
+            _has_address(address.get("Address") or {}) for address in (party.get("Addresses") or {}).get("$values", [])
+        ),
+    }
+    return {field for field, value in filled.items() if value}
+
+
+class ActivityMapping:
+    """Record -> Activity GenericEntityData mapping, compiled once per sink.
+
+    The field mappings are resolved once, and so is the timezone of
+    TRANSACTION_DATE, whose formatted value is reused within a second.
+    """
+
+    def __init__(self, schema=None, field_mappings=None, timezone_name=DEFAULT_ACTIVITY_TIMEZONE):
+        import pytz
+
+        mappings = dict(DEFAULT_ACTIVITY_FIELD_MAPPINGS)
+        # A null mapping drops a default one
+        mappings.update(field_mappings or {})
+        # Fields a schema without additional properties doesn't declare can't be in a record
+        schema = schema or {}
+        properties = schema.get("properties") if schema.get("additionalProperties") is False else None
+        self.fields = tuple(
+            (source_field, target_field)
+            for source_field, target_field in mappings.items()
+            if target_field and (properties is None or source_field in properties)
+        )
+        self.timezone = pytz.timezone(timezone_name)
+        self._transaction_date = (None, None)
+
+    def transaction_date(self):
+        second = int(time.time())
+        cached_second, value = self._transaction_date
+        if cached_second != second:
+            value = datetime.fromtimestamp(second, self.timezone).strftime("%Y-%m-%dT%H:%M:%S")
+            self._transaction_date = (second, value)
+        return value
+
+    def build(self, record, party_id):
+        values = [
+            {"Name": "PartyId", "Value": party_id},
+            {"Name": "TRANSACTION_DATE", "Value": self.transaction_date()},
+        ]
+        for source_field, target_field in self.fields:
+            value = record.get(source_field)
+            if value:
+                values.append({"Name": target_field, "Value": value})
+        # Custom fields (UF1-UF7) carry their property name
+        for custom_field in record.get("custom_fields") or ():
+            values.append({"Name": custom_field["name"], "Value": custom_field["value"]})
+        return {"$type": GENERIC_ENTITY_DATA, "properties": {"$values": values}}
@@ -0,0 +1,149 @@
+"""Request and processing-time instrumentation of a target run."""
+import json
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import singer
+
+LOGGER = singer.get_logger()
+
+# Upper bounds, in milliseconds, of the latency histogram buckets
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+def endpoint_label(method, url):
+    """Group a request under its method and iMIS resource, e.g. `PUT Party/{id}` or `GET Party`."""
+    segments = [segment for segment in urlsplit(url).path.split("/") if segment]
+    if segments and segments[0].lower() == "api":
+        segments = segments[1:]
+    if not segments:
+        return f"{method} /"
+    return f"{method} {segments[0]}" + ("/{id}" if len(segments) > 1 else "")
+
+
+class Histogram:
+    """Count, total and bucketed distribution of durations."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def observe(self, milliseconds):
+        self.count += 1
+        self.total_ms += milliseconds
+        self.max_ms = max(self.max_ms, milliseconds)
+        for index, bound in enumerate(LATENCY_BUCKETS_MS):
+            if milliseconds <= bound:
+                self.buckets[index] += 1
+                return
+        self.buckets[-1] += 1
+
+    def percentile(self, percentile):
+        """Upper bound of the bucket holding the percentile, the max for the overflow bucket."""
+        threshold = self.count * percentile / 100
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= threshold:
+                return LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else round(self.max_ms, 1)
+        return 0
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total_ms": round(self.total_ms, 1),
+            "mean_ms": round(self.total_ms / self.count, 1) if self.count else 0,
+            "p50_ms": self.percentile(50),
+            "p99_ms": self.percentile(99),
+            "max_ms": round(self.max_ms, 1),
+        }
+
+
+class Metrics:
+    """Thread-safe counters and latency histograms, logged as `METRIC:` JSON lines.
+
+    Requests are grouped per endpoint and method, processing time per sink
+    stage, retries and errors per exception class. A snapshot is logged
+    every `interval` seconds (never when 0), and a summary at the end of
+    the run.
+    """
+
+    def __init__(self, interval=60.0):
+        self.interval = interval
+        self.requests = {}
+        self.statuses = {}
+        self.stages = {}
+        self.retries = {}
+        self.errors = {}
+        # Name -> callable returning the current value of something measured elsewhere
+        self.gauges = {}
+        self._started_at = time.monotonic()
+        self._emitted_at = self._started_at
+        self._lock = threading.Lock()
+
+    def observe_request(self, method, url, seconds, status_code=None):
+        label = endpoint_label(method, url)
+        with self._lock:
+            self.requests.setdefault(label, Histogram()).observe(seconds * 1000)
+            statuses = self.statuses.setdefault(label, {})
+            status = str(status_code) if status_code else "no_response"
+            statuses[status] = statuses.get(status, 0) + 1
+        self.maybe_emit()
+
+    def observe_stage(self, stage, seconds):
+        with self._lock:
+            self.stages.setdefault(stage, Histogram()).observe(seconds * 1000)
+
+    @contextmanager
+    def timer(self, stage):
+        """Record the time spent in the block under `stage`."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - started)
+
+    def count_retry(self, label, error):
+        self._increment(self.retries, f"{label} {type(error).__name__}")
+
+    def count_error(self, stream, error):
+        self._increment(self.errors, f"{stream} {type(error).__name__}")
+
+    def _increment(self, counters, key):
+        with self._lock:
+            counters[key] = counters.get(key, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {
+                "elapsed_seconds": round(time.monotonic() - self._started_at, 1),
+                "requests": {
+                    label: dict(histogram.to_dict(), statuses=dict(self.statuses.get(label, {})))
+                    for label, histogram in sorted(self.requests.items())
+                },
+                "stages": {stage: histogram.to_dict() for stage, histogram in sorted(self.stages.items())},
+                "retries": dict(self.retries),
+                "errors": dict(self.errors),
+            }
+        for name, gauge in self.gauges.items():
+            snapshot[name] = gauge()
+        return snapshot
+
+    def maybe_emit(self):
+        if not self.interval or time.monotonic() - self._emitted_at < self.interval:
+            return
+        with self._lock:
+            # Another thread may have emitted while this one waited for the lock
+            if time.monotonic() - self._emitted_at < self.interval:
+                return
+            self._emitted_at = time.monotonic()
+        self.emit()
+
+    def emit(self, summary=False):
+        snapshot = self.snapshot()
+        snapshot["type"] = "summary" if summary else "periodic"
+        LOGGER.info(f"METRIC: {json.dumps(snapshot, sort_keys=True)}")
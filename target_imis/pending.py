@@ -0,0 +1,67 @@
+"""Registry of the contacts queued for upsert, for streams running in parallel."""
+import threading
+
+import singer
+
+LOGGER = singer.get_logger()
+
+# Longest an activity waits for a pending contact before looking it up anyway
+PENDING_CONTACT_TIMEOUT = 300
+
+
+class PendingContacts:
+    """Normalized emails of the contact records queued but not yet upserted.
+
+    Contacts register their email when they are read and release it once
+    processed, successfully or not. Activities referencing one of those
+    emails wait for its release, and for nothing else of the Contacts stream.
+    """
+
+    def __init__(self, timeout=PENDING_CONTACT_TIMEOUT):
+        self.timeout = timeout
+        self.waits = 0
+        self._pending = {}
+        # Emails a wait timed out for, the next waits for them don't block
+        self._timed_out = set()
+        self._lock = threading.Lock()
+
+    def add(self, email):
+        if not email:
+            return
+        with self._lock:
+            entry = self._pending.get(email)
+            if entry is None:
+                entry = self._pending[email] = [0, threading.Event()]
+            entry[0] += 1
+
+    def release(self, email):
+        if not email:
+            return
+        with self._lock:
+            entry = self._pending.get(email)
+            if entry is None:
+                return
+            entry[0] -= 1
+            if entry[0] <= 0:
+                del self._pending[email]
+                self._timed_out.discard(email)
+                entry[1].set()
+
+    def is_pending(self, email):
+        return bool(email) and email in self._pending
+
+    def wait(self, email):
+        """Wait until no contact record with the email is pending, return whether it was released in time."""
+        with self._lock:
+            entry = self._pending.get(email) if email else None
+            if entry is not None and email in self._timed_out:
+                return False
+        if entry is None:
+            return True
+        self.waits += 1
+        if entry[1].wait(self.timeout):
+            return True
+        with self._lock:
+            self._timed_out.add(email)
+        LOGGER.warning(f"Contact {email} still pending after {self.timeout}s, looking it up anyway")
+        return False
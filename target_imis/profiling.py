@@ -0,0 +1,54 @@
+"""cProfile of a whole run, the threads it starts included."""
+import cProfile
+import io
+import pstats
+import sys
+import threading
+
+# Functions listed in the text report, by cumulative and by own time
+REPORT_LIMIT = 40
+
+
+def run_profiled(path, func, *args, **kwargs):
+    """Call `func` under cProfile and write the stats to `path`, and a text report to `path`.txt.
+
+    cProfile only follows the thread it's enabled in, so each thread the
+    run starts (sink workers, stream threads) gets its own profiler, and
+    the stats are merged once the run is over.
+    """
+    thread_profilers = []
+    lock = threading.Lock()
+
+    def profile_thread(frame, event, arg):
+        profiler = cProfile.Profile()
+        with lock:
+            thread_profilers.append(profiler)
+        sys.setprofile(None)
+        profiler.enable()
+
+    profiler = cProfile.Profile()
+    threading.setprofile(profile_thread)
+    profiler.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        threading.setprofile(None)
+        write_report(path, profiler, thread_profilers)
+
+
+def write_report(path, profiler, thread_profilers=()):
+    stats = pstats.Stats(profiler)
+    for thread_profiler in thread_profilers:
+        thread_profiler.create_stats()
+        if thread_profiler.stats:
+            stats.add(thread_profiler)
+    stats.dump_stats(path)
+
+    report = io.StringIO()
+    report_stats = pstats.Stats(path, stream=report)
+    report.write(f"Profile of the run, {len(thread_profilers)} threads besides the main one\n")
+    report_stats.sort_stats("cumulative").print_stats(REPORT_LIMIT)
+    report_stats.sort_stats("tottime").print_stats(REPORT_LIMIT)
+    with open(f"{path}.txt", "w") as report_file:
+        report_file.write(report.getvalue())
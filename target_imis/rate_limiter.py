@@ -0,0 +1,124 @@
+"""Adaptive rate limiting of the requests sent to the iMIS host."""
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import singer
+
+LOGGER = singer.get_logger()
+
+# Status codes meaning the host is over capacity, as opposed to a failing request
+THROTTLE_STATUS_CODES = (429, 502, 503, 504)
+
+
+def parse_retry_after(value):
+    """Return the number of seconds a `Retry-After` header asks to wait, if any."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class AdaptiveRateLimiter:
+    """Token bucket shared by every sink, with an AIMD-controlled rate.
+
+    The rate is cut by `decrease_factor` when the host throttles us, and
+    raised by `increase` requests/second after `success_threshold`
+    consecutive successful responses, up to `max_rate`. A `Retry-After`
+    header pauses every caller until it has elapsed.
+
+    Without a `max_rate`, requests aren't limited until the host first
+    throttles us, the rate is then cut from the one measured over the last
+    second, and raised without a ceiling.
+    """
+
+    # Seconds after a decrease during which further throttled responses don't lower the rate
+    decrease_interval = 1.0
+
+    def __init__(self, max_rate=None, min_rate=1.0, increase=1.0, decrease_factor=0.5, success_threshold=20):
+        self.max_rate = max_rate or None
+        self.min_rate = min(min_rate, max_rate) if max_rate else min_rate
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.success_threshold = success_threshold
+        # None while requests aren't limited
+        self.rate = self.max_rate
+        self.throttled = 0
+        self._tokens = 1.0
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._successes = 0
+        # Send times of the last second while requests aren't limited
+        self._sent = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self.rate is None:
+                    self._sent.append(now)
+                    while self._sent[0] < now - 1:
+                        self._sent.popleft()
+                    return
+                else:
+                    self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._updated_at) * self.rate)
+                    self._updated_at = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def observe(self, response):
+        """Adjust the rate to the outcome of a request."""
+        if response.status_code in THROTTLE_STATUS_CODES:
+            self.on_throttle(parse_retry_after(response.headers.get("Retry-After")))
+        elif response.status_code < 500:
+            self.on_success()
+
+    def on_success(self):
+        with self._lock:
+            self._successes += 1
+            if self._successes < self.success_threshold or self.rate is None:
+                return
+            if self.max_rate is None or self.rate < self.max_rate:
+                self.rate = min(self.max_rate or float("inf"), self.rate + self.increase)
+                self._successes = 0
+
+    def on_throttle(self, retry_after=None):
+        with self._lock:
+            now = time.monotonic()
+            self.throttled += 1
+            self._successes = 0
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+            # Responses to requests sent before the last decrease don't lower the rate again
+            if now - self._last_decrease < self.decrease_interval:
+                return
+            self._last_decrease = now
+            if self.rate is None:
+                # The rate requests were sent at over the last second
+                self.rate = len([sent_at for sent_at in self._sent if sent_at >= now - 1])
+                self._sent.clear()
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self._tokens = min(self._tokens, 0.0)
+        LOGGER.warning(f"iMIS is throttling requests, lowering the request rate to {self.rate:.1f}/s")
+
+    def metrics(self):
+        return {"request_rate": round(self.rate, 2) if self.rate else None, "throttled_responses": self.throttled}
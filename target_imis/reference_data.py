@@ -0,0 +1,76 @@
+"""Cache of slowly changing iMIS reference data, persisted across runs."""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import singer
+
+LOGGER = singer.get_logger()
+
+
+class ReferenceData:
+    """Named reference data sets (address purposes, ...) of one iMIS site, each trusted for `ttl` seconds.
+
+    With a `directory`, the data sets are kept in a JSON file per site, so
+    the runs against a site share them. `refresh` fetches every data set
+    again, once per run, whatever its age.
+    """
+
+    def __init__(self, site, directory=None, ttl=86400, refresh=False):
+        self.site = site
+        self.ttl = ttl
+        self.refresh = refresh
+        self.path = None
+        if directory:
+            site_key = hashlib.sha256(site.encode()).hexdigest()[:16]
+            self.path = os.path.join(directory, f"reference-{site_key}.json")
+        self._entries = None
+        self._fetched = set()
+        self._lock = threading.Lock()
+
+    def _load(self):
+        self._entries = {}
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as reference_file:
+                data = json.load(reference_file)
+        except (OSError, ValueError) as e:
+            LOGGER.warning(f"Ignoring unreadable reference data cache {self.path}: {e}")
+            return
+        if data.get("site") == self.site:
+            self._entries = data.get("entries") or {}
+
+    def _save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        # Written aside and renamed, so concurrent runs never read a partial file
+        file_descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(file_descriptor, "w") as reference_file:
+                json.dump({"site": self.site, "entries": self._entries}, reference_file)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            LOGGER.warning(f"Could not write the reference data cache {self.path}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def get(self, name, fetch):
+        """Return the data set `name`, calling `fetch()` for it when it's missing, stale or refreshed."""
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            entry = self._entries.get(name)
+            stale = not entry or time.time() - entry["fetched_at"] > self.ttl
+            if stale or (self.refresh and name not in self._fetched):
+                LOGGER.info(f"Fetching reference data: {name}")
+                entry = {"fetched_at": time.time(), "value": fetch()}
+                self._entries[name] = entry
+                self._fetched.add(name)
+                self._save()
+            return entry["value"]
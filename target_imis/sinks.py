@@ -1,11 +1,30 @@
 """IMIS target sink class, which handles writing streams."""
 
-from target_imis.client import IMISSink
-from datetime import datetime
-import pytz
+from target_imis.client import IMISSink, normalize_entity
+from target_imis.cache import normalize_email
+from target_imis.mapping import (
+    CONTACT_FIELDS,
+    EMAIL_DATA_COLLECTION,
+    FULL_ADDRESS_DATA_COLLECTION,
+    PERSON_DATA,
+    PERSON_NAME_DATA,
+    PHONE_DATA_COLLECTION,
+    PRIMARY_ORGANIZATION_DATA,
+    ActivityMapping,
+    DEFAULT_ACTIVITY_TIMEZONE,
+    collection,
+    email_data,
+    filled_contact_fields,
+    full_address_data,
+    phone_data,
+)
 import json
 import singer
+from functools import cached_property
 from hotglue_etl_exceptions import InvalidPayloadError
+from hotglue_singer_sdk.exceptions import FatalAPIError, RetriableAPIError
+from target_imis.exceptions import UnknownContactError
+from target_imis.lookup_planner import LookupPlanner
 
 LOGGER = singer.get_logger()
 
@@ -15,23 +34,42 @@ class ContactsSink(IMISSink):
     name = "Contacts"
     endpoint = "Party"
     entity = "Party"
-    contacts = []
+    _not_prefetched = object()
+
+    fieldKeyMapping = {
+        "first_name": 'firstname',
+        "last_name": 'lastname',
+        "email": 'email',
+        "id": 'id'
+    }
+
+    # Query keys in the order they narrow a Party search the most
+    selective_lookup_keys = ["id", "email", "lastname", "firstname"]
+    # EmailType of the emails of coalesced records other than the primary one
+    additional_email_type = "_Alternate"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Lookups of the batch resolved by prepare_batch, by query
+        self._prefetched_contacts = {}
+        # Emails of the buffered records, with parallel streams
+        self._buffered_emails = set()
+
+    @cached_property
+    def lookup_planner(self):
+        return LookupPlanner()
 
     def get_lookup_suffix(self, lookup_fields, record):
+        """Return the query of a lookup, a list of fields being searched with one AND query."""
 
-        fieldKeyMapping = {
-            "first_name": 'firstname',
-            "last_name": 'lastname',
-            "email": 'email',
-            "id": 'id'
-        }
+        fieldKeyMapping = self.fieldKeyMapping
 
         if isinstance(lookup_fields, str):
             if lookup_fields.lower() in fieldKeyMapping:
                 if record.get(lookup_fields.lower()):
                     return f"?{fieldKeyMapping[lookup_fields.lower()]}={record.get(lookup_fields.lower())}"
             return None
-        elif isinstance(lookup_fields, list) and self.lookup_method == "all":
+        elif isinstance(lookup_fields, list):
             suffix = "?"
             for field in lookup_fields:
                 if field.lower() in fieldKeyMapping:
@@ -47,59 +85,377 @@ class ContactsSink(IMISSink):
         
     
     def get_matching_contact(self, record, lookup_fields):
-        LOGGER.info(f"Checking for contact with lookup field(s): {lookup_fields}")
+        LOGGER.debug("Checking for contact with lookup field(s): %s", lookup_fields)
 
 
         if isinstance(lookup_fields, list) and self.lookup_method == "sequential":
-            for field in lookup_fields:
-                matching_contact = self.get_matching_contact(record, field)
-                if matching_contact:
-                    return matching_contact
-            return None
-        
+            return self.get_sequential_matching_contact(record, lookup_fields)
+
+        contacts = self.find_contacts(record, lookup_fields)
+        if contacts:
+            LOGGER.debug("Found contact via lookup field(s): %s", lookup_fields)
+            self.party_cache.put(contacts[0])
+            return contacts[0]
+        return None
+
+    def get_sequential_matching_contact(self, record, lookup_fields):
+        """Try the searches the lookup planner orders for the record until one matches a contact.
+
+        A search matching several contacts resolves to the one also matching
+        the fields tried after it, or to none of them when they all differ.
+        """
+        fields = [
+            field.lower() for field in lookup_fields
+            if field.lower() in self.fieldKeyMapping and record.get(field.lower())
+        ]
+        steps = self.lookup_planner.plan(fields)
+        for position, step in enumerate(steps):
+            contacts = self.find_contacts(record, step[0] if len(step) == 1 else list(step))
+            ambiguous = len(contacts) > 1
+            if ambiguous:
+                later_criteria = self.get_lookup_criteria([later[0] for later in steps[position + 1:]], record)
+                contacts = [
+                    contact for contact in contacts
+                    if all(value.strip().lower() in self.get_party_values(contact, key) for key, value in later_criteria)
+                ]
+            self.lookup_planner.record(step, bool(contacts), ambiguous)
+            if contacts:
+                LOGGER.debug("Found contact via lookup field(s): %s", step)
+                self.party_cache.put(contacts[0])
+                return contacts[0]
+        return None
+
+    def find_contacts(self, record, lookup_fields):
+        """Return the contacts a lookup matches, from the cache, the batch prefetch or a search."""
         lookup_suffix = self.get_lookup_suffix(lookup_fields, record)
 
         if not lookup_suffix:
-            return None
+            return []
+
+        cached_contact = self.get_cached_contact(self.get_lookup_criteria(lookup_fields, record))
+        if cached_contact:
+            LOGGER.debug("Found cached contact via lookup field(s): %s", lookup_fields)
+            return [cached_contact]
 
-        LOGGER.info(f"Searching for existing contact with suffix: {lookup_suffix}")
+        # Each prefetched result is used once, a repeated lookup in the batch may follow a write
+        prefetched_contact = self._prefetched_contacts.pop(lookup_suffix, self._not_prefetched)
+        if prefetched_contact is not self._not_prefetched:
+            return [prefetched_contact] if prefetched_contact else []
+
+        LOGGER.debug("Searching for existing contact with suffix: %s", lookup_suffix)
         search_response = self.request_api(
             "GET",
             endpoint=f"{self.endpoint}{lookup_suffix}",
             headers=self.prepare_request_headers(),
         )
-        LOGGER.info(f"Response Status: {search_response.status_code}")
-        search_response = search_response.json()
-
-        if search_response["Items"]["$values"]:
-            LOGGER.info(f"Found contact via lookup field(s): {lookup_fields}")
-            return search_response["Items"]["$values"][0]
+        LOGGER.debug("Response Status: %s", search_response.status_code)
+        return search_response.json()["Items"]["$values"]
+
+    def get_cached_contact(self, criteria):
+        """Return a cached Party matching every lookup criterion, if any."""
+        for key, value in criteria:
+            if key == "id":
+                party = self.party_cache.get_by_id(value)
+            elif key == "email":
+                party = self.party_cache.get_by_email(value)
+            else:
+                continue
+            if party and all(
+                criteria_value.strip().lower() in self.get_party_values(party, criteria_key)
+                for criteria_key, criteria_value in criteria
+            ):
+                return party
         return None
-    
+
+    def get_lookup_criteria(self, lookup_fields, record):
+        """Return the (query key, value) pairs a lookup for the record filters on."""
+        fields = [lookup_fields] if isinstance(lookup_fields, str) else lookup_fields
+        return [
+            (self.fieldKeyMapping[field.lower()], str(record.get(field.lower())))
+            for field in fields
+            if field.lower() in self.fieldKeyMapping and record.get(field.lower())
+        ]
+
+    def prefetch_matching_contacts(self, records, lookup_fields):
+        """Resolve the lookups of a batch of records with as few Party queries as possible."""
+        pending = {}
+        for record in records:
+            lookup_suffix = self.get_lookup_suffix(lookup_fields, record)
+            if not lookup_suffix or lookup_suffix in self._prefetched_contacts:
+                continue
+            criteria = self.get_lookup_criteria(lookup_fields, record)
+            if any("|" in value for _, value in criteria):
+                # Can't be expressed in a multi-valued filter, left to the per-record lookup
+                continue
+            pending[lookup_suffix] = criteria
+
+        # Query on the most selective key of each lookup, the remaining criteria are matched in memory
+        driving_criteria = {
+            lookup_suffix: min(criteria, key=lambda item: self.selective_lookup_keys.index(item[0]))
+            for lookup_suffix, criteria in pending.items()
+        }
+        values_by_key = {}
+        for key, value in driving_criteria.values():
+            values_by_key.setdefault(key, set()).add(value.strip().lower())
+
+        parties_by_value = {}
+        for key, values in values_by_key.items():
+            LOGGER.info(f"Prefetching contacts for {len(values)} distinct {key} value(s)")
+            for party in self.search_parties(key, sorted(values)):
+                for value in self.get_party_values(party, key):
+                    parties_by_value.setdefault((key, value), []).append(party)
+
+        for lookup_suffix, criteria in pending.items():
+            key, value = driving_criteria[lookup_suffix]
+            parties = [
+                party for party in parties_by_value.get((key, value.strip().lower()), [])
+                if all(
+                    criteria_value.strip().lower() in self.get_party_values(party, criteria_key)
+                    for criteria_key, criteria_value in criteria
+                )
+            ]
+            if len(parties) > 1 and self.lookup_method == "sequential":
+                # Left to the per-record lookup, which tells the contacts apart
+                continue
+            self._prefetched_contacts[lookup_suffix] = parties[0] if parties else None
+
+    def prepare_batch(self, records):
+        self._prefetched_contacts = {}
+        lookup_fields = self.lookup_fields_dict.get("Contact", "email")
+        try:
+            if self.preload_organizations == "batch":
+                self.prefetch_organizations(records)
+            if isinstance(lookup_fields, list) and self.lookup_method == "sequential":
+                fields = [field.lower() for field in lookup_fields if field.lower() in self.fieldKeyMapping]
+                for field in self.lookup_planner.order(fields):
+                    if self.lookup_planner.is_ambiguous(field):
+                        # Searched together with the next fields, record by record
+                        break
+                    self.prefetch_matching_contacts(records, field)
+                    # Only records without a match on this field fall through to the next one
+                    records = [
+                        record for record in records
+                        if not self._prefetched_contacts.get(self.get_lookup_suffix(field, record))
+                    ]
+            else:
+                self.prefetch_matching_contacts(records, lookup_fields)
+        except (FatalAPIError, RetriableAPIError) as e:
+            LOGGER.warning(f"Batched contact lookup failed, falling back to per-record lookups: {e}")
+
+    def finish_batch(self):
+        self._prefetched_contacts = {}
+
+    def clean_up(self):
+        super().clean_up()
+        summary = self.lookup_planner.summary() if "lookup_planner" in self.__dict__ else None
+        if summary:
+            LOGGER.info(f"Sequential contact lookups: {summary}")
+
+    def on_record_read(self, record, context):
+        # With parallel streams, activities referencing the contact's email wait for its upsert
+        if self.parallel_streams and record.get("email"):
+            context["pending_email"] = normalize_email(record["email"])
+            self.pending_contacts.add(context["pending_email"])
+            if self.batch_size > 1:
+                self._buffered_emails.add(context["pending_email"])
+
+    def record_done(self, context):
+        for record_context in [context] + context.get("coalesced_contexts", []):
+            self.pending_contacts.release(record_context.pop("pending_email", None))
+
+    def is_buffered(self, email):
+        """Whether a record with the email waits in the buffer for the batch to be drained."""
+        return email in self._buffered_emails
+
+    def process_batch(self, context):
+        self._buffered_emails = set()
+        super().process_batch(context)
+
+    def get_record_keys(self, record):
+        lookup_fields = self.lookup_fields_dict.get("Contact", "email")
+        keys = {(key, value.strip().lower()) for key, value in self.get_lookup_criteria(lookup_fields, record)}
+        for email in [record.get("email")] + record.get("_additional_emails", []):
+            if email:
+                keys.add(("email", normalize_email(email)))
+        return keys
+
+    def get_coalesce_key(self, lookup_fields, record):
+        """Key shared by the records a lookup resolves to the same contact, None when it can't tell."""
+        criteria = [(key, value.strip().lower()) for key, value in self.get_lookup_criteria(lookup_fields, record)]
+        if not criteria:
+            return None
+        if isinstance(lookup_fields, list) and self.lookup_method == "sequential":
+            fields = [field.lower() for field in lookup_fields if field.lower() in self.fieldKeyMapping and record.get(field.lower())]
+            first_field = self.lookup_planner.order(fields)[0]
+            # The first id or email the lookup tries decides the contact, names are told apart by the other fields
+            if first_field in ("id", "email"):
+                return tuple(item for item in criteria if item[0] == first_field)
+        return tuple(criteria)
+
+    def coalesce_records(self, buffered_records):
+        """Merge the buffered records that look up the same contact, so each contact is written once."""
+        if not self.config.get("coalesce_records", True):
+            return buffered_records
+        lookup_fields = self.lookup_fields_dict.get("Contact", "email")
+        coalesced_records = []
+        position_of_key = {}
+        for record, context in buffered_records:
+            # A record committed by a previous run is reported, not merged
+            key = None if context.get("journaled") else self.get_coalesce_key(lookup_fields, record)
+            if key is None or key not in position_of_key:
+                if key is not None:
+                    position_of_key[key] = len(coalesced_records)
+                coalesced_records.append((record, context))
+                continue
+            position = position_of_key[key]
+            merged_record, merged_context = coalesced_records[position]
+            if "coalesced_contexts" not in merged_context:
+                merged_record = dict(merged_record)
+                merged_context = dict(merged_context, coalesced_contexts=[])
+            self.merge_records(merged_record, record)
+            merged_context["coalesced_contexts"].append(context)
+            coalesced_records[position] = (merged_record, merged_context)
+
+        if len(coalesced_records) < len(buffered_records):
+            LOGGER.info(f"Coalesced {len(buffered_records)} records into {len(coalesced_records)} distinct contacts")
+        return coalesced_records
+
+    def merge_records(self, merged_record, record):
+        """Merge a later record into `merged_record`: lists are unioned, other fields are last-write-wins."""
+        external_id_key = self._target.EXTERNAL_ID_KEY
+        for field, value in record.items():
+            if field in (external_id_key, external_id_key.lower()) or value in (None, "", []):
+                continue
+            if field == "phone_numbers" and isinstance(value, list):
+                phone_numbers = list(merged_record.get("phone_numbers") or [])
+                numbers = {phone.get("number") if isinstance(phone, dict) else phone for phone in phone_numbers}
+                for phone in value:
+                    number = phone.get("number") if isinstance(phone, dict) else phone
+                    if number not in numbers:
+                        numbers.add(number)
+                        phone_numbers.append(phone)
+                merged_record["phone_numbers"] = phone_numbers
+            elif field == "addresses" and isinstance(value, list):
+                addresses = list(merged_record.get("addresses") or [])
+                for address in value:
+                    if address not in addresses:
+                        addresses.append(address)
+                merged_record["addresses"] = addresses
+            elif field == "email" and merged_record.get("email"):
+                emails = [merged_record["email"]] + merged_record.get("_additional_emails", [])
+                if normalize_email(value) not in {normalize_email(email) for email in emails}:
+                    merged_record["_additional_emails"] = merged_record.get("_additional_emails", []) + [value]
+            else:
+                merged_record[field] = value
+
     def get_organization_by_id(self, party_id):
         # Organizations use same endpoint as contacts
-        LOGGER.info(f"Getting organization by id: {party_id}")
-        search_response = self.request_api(
-            "GET",
-            endpoint=f"{self.endpoint}?id={party_id}",
-            headers=self.prepare_request_headers(),
-        )
-        LOGGER.info(f"Response Status: {search_response.status_code}")
-        search_response = search_response.json()
+        return self.get_party_by_id(party_id)
+
+    @property
+    def preload_organizations(self):
+        preload_organizations = self.config.get("preload_organizations")
+        return "all" if preload_organizations is True else preload_organizations
+
+    @cached_property
+    def organization_names(self):
+        """Organization id -> name, loaded once for the whole directory when preload_organizations is "all"."""
+        if self.preload_organizations != "all":
+            return {}
+        organization_names = {
+            str(organization.get("Id") or organization.get("PartyId")): organization.get("OrganizationName")
+            for organization in self.get_paged_items("Organization")
+        }
+        LOGGER.info(f"Preloaded {len(organization_names)} organizations")
+        return organization_names
+
+    def prefetch_organizations(self, records):
+        """Resolve the names of the organizations a batch of records references with multi-valued queries."""
+        company_ids = {
+            str(record["company_id"]) for record in records
+            if record.get("company_id") and str(record["company_id"]) not in self.organization_names
+            and "|" not in str(record["company_id"])
+        }
+        if not company_ids:
+            return
+        for organization in self.search_parties("id", sorted(company_ids)):
+            self.organization_names[str(organization.get("Id") or organization.get("PartyId"))] = organization.get("OrganizationName")
+
+    def get_organization_name(self, company_id):
+        company_id = str(company_id)
+        if company_id in self.organization_names:
+            return self.organization_names[company_id]
+
+        company = self.get_organization_by_id(company_id)
+        company_name = company.get("OrganizationName") if company else None
+        if self.preload_organizations:
+            # Organizations aren't written by this target, a miss stays a miss for the run
+            self.organization_names[company_id] = company_name
+        return company_name
+
+    def get_indexed_contact(self, record, external_id=None):
+        """Return the contact the identity index maps the record's externalId or email to."""
+        if not self.identity_index:
+            return None
 
-        if search_response["Items"]["$values"]:
-            LOGGER.info(f"Found organization via id: {party_id}")
-            return search_response["Items"]["$values"][0]
+        lookup_fields = self.lookup_fields_dict.get("Contact", "email")
+        criteria = self.get_lookup_criteria(lookup_fields, record)
+        lookup_fields = [lookup_fields] if isinstance(lookup_fields, str) else lookup_fields
+        identities = []
+        if external_id:
+            identities.append(("externalId", external_id))
+        # An email lookup already resolved by the batch prefetch costs nothing, the index would cost a fetch
+        if (
+            record.get("email")
+            and "email" in [field.lower() for field in lookup_fields]
+            and self.get_lookup_suffix("email", record) not in self._prefetched_contacts
+        ):
+            identities.append(("email", record.get("email")))
+
+        for kind, value in identities:
+            indexed = self.identity_index.get(kind, value)
+            if not indexed:
+                continue
+            # The fetched contact verifies the entry, whatever its age
+            contact = self.get_party_by_id(indexed[0])
+            if (
+                contact
+                and (kind == "externalId" or normalize_email(value) in self.get_party_values(contact, "email"))
+                and self.matches_lookup(contact, criteria)
+            ):
+                return contact
+            self.identity_index.discard(kind, value)
         return None
 
+    def matches_lookup(self, contact, criteria):
+        """Whether a contact satisfies the lookup criteria of a record, under the configured lookup method."""
+        if not criteria:
+            return True
+        matches = (value.strip().lower() in self.get_party_values(contact, key) for key, value in criteria)
+        return any(matches) if self.lookup_method == "sequential" else all(matches)
+
+    def index_contact(self, party, context):
+        """Record the PartyId of an upserted contact under its emails and the externalIds of its records."""
+        if not self.identity_index or not party.get("Id"):
+            return
+        for email in self.get_party_values(party, "email"):
+            self.identity_index.put("email", email, party["Id"])
+        for record_context in [context] + context.get("coalesced_contexts", []):
+            if record_context.get("external_id"):
+                self.identity_index.put("externalId", record_context["external_id"], party["Id"])
 
     def upsert_record(self, record: dict, context: dict):
-        LOGGER.info(f"Upserting record...")
+        LOGGER.debug("Upserting record...")
         state_dict = dict()
         method = "POST"
         endpoint = self.endpoint
 
         if record.get("Id"):
+            if context.get("unchanged"):
+                LOGGER.debug("Contact %s is unchanged, skipping update", record.get("Id"))
+                state_dict.update({"success": True, "unchanged": True, "existing": True})
+                self.index_contact(record, context)
+                return record.get("Id"), True, state_dict
             method = "PUT"
             endpoint += f"/{record.get('Id')}"
 
@@ -109,144 +465,114 @@ class ContactsSink(IMISSink):
             endpoint=endpoint,
             headers=self.prepare_request_headers(),
         )
-        LOGGER.info(f"Response: {response.status_code}")
+        LOGGER.debug("Response: %s", response.status_code)
 
         if response.ok:
             state_dict["success"] = True
-            id = response.json()["Id"]
+            party = response.json()
+            id = party["Id"]
+            self.party_cache.put(party)
+            self.index_contact(party, context)
+            # Activities for the contact's emails can be resolved from now on
+            for email in self.get_party_values(party, "email"):
+                self.negative_cache.discard(email)
             if method == "PUT":
                 state_dict["is_updated"] = True
             return id, response.ok, state_dict
 
         return None, False, state_dict
 
+    def plan_contact_fields(self, party, record):
+        """Return the CONTACT_FIELDS the upsert writes to a Party.
+
+        With `only_upsert_empty_fields`, an existing contact only gets the
+        fields it has no value for and the record has one for.
+        """
+        if not self.config.get("only_upsert_empty_fields", False) or not party.get("Id"):
+            return set(CONTACT_FIELDS)
+        record_fields = {field for field in CONTACT_FIELDS if record.get(field)}
+        if record.get("_additional_emails"):
+            record_fields.add("email")
+        fields_to_write = record_fields - filled_contact_fields(party)
+        LOGGER.debug("Fields to fill on contact %s: %s", party.get("Id"), sorted(fields_to_write))
+        return fields_to_write
+
     def preprocess_record(self, record: dict, context: dict) -> dict:
         payload = dict()
-        LOGGER.info(f"Preprocessing record: {record.get('first_name', '')} {record.get('last_name', '')}")
+        LOGGER.debug("Preprocessing record: %s %s", record.get("first_name", ""), record.get("last_name", ""))
         # If there's an email, see if there's a matching contact that already exists
-        LOGGER.info("Checking for existing contact with email")
+        LOGGER.debug("Checking for existing contact with email")
 
         lookup_fields = self.lookup_fields_dict.get("Contact", "email")
 
-        payload = self.get_matching_contact(record, lookup_fields) or {
-            "$type": "Asi.Soa.Membership.DataContracts.PersonData, Asi.Contracts",
-        }
-
-        should_only_update_empty_fields = self.config.get("only_upsert_empty_fields", False)
-
-
-        if should_only_update_empty_fields:
-            fields_to_ignore = [
-                ("first_name", payload.get("PersonName", {}).get("FirstName")),
-                ("last_name", payload.get("PersonName", {}).get("LastName")),
-                ("email", payload.get("Emails", {}).get("$values", [{}])[0].get("Address")),
-                ("company_id", payload.get("PrimaryOrganization", {}).get("OrganizationPartyId"))
-            ]
-            for field_name, existing_field_value in fields_to_ignore:
-                if existing_field_value:
-                    record[field_name] = existing_field_value
-        
-        person_name = payload.get("PersonName", {
-            "$type": "Asi.Soa.Membership.DataContracts.PersonNameData, Asi.Contracts"
-        })
-
-        person_name["FirstName"] = record.get("first_name")
-        person_name["LastName"] = record.get("last_name")
-
-        payload.update(
-            {
-                "PersonName": person_name,
-            }
-        )
-
-
-        email_payload = payload.get("Emails", {
-                    "$type": "Asi.Soa.Membership.DataContracts.EmailDataCollection, Asi.Contracts",
-                    "$values": [],
-                })
-        
-        # Add email to existing emails if it's not already there
-        if record.get("email") and not any(email.get("Address") == record.get("email") for email in email_payload.get("$values", [])):
-            email_payload["$values"].append({
-                "$type": "Asi.Soa.Membership.DataContracts.EmailData, Asi.Contracts",
-                "Address": record.get("email"),
-                "EmailType": "_Primary",
-                "IsPrimary": True,
-            })
-
-        payload["Emails"] = email_payload
-
+        payload = (
+            self.get_indexed_contact(record, context.get("external_id"))
+            or self.get_matching_contact(record, lookup_fields)
+        ) or {"$type": PERSON_DATA}
+        # Snapshot of the existing contact, to skip the update when nothing changes
+        existing_contact = normalize_entity(payload) if payload.get("Id") and self.skip_unchanged_records else None
+
+        fields_to_write = self.plan_contact_fields(payload, record)
+        if not fields_to_write:
+            LOGGER.debug("Contact %s has no empty field to fill, skipping update", payload.get("Id"))
+            context["unchanged"] = True
+            return payload
+
+        if "first_name" in fields_to_write or "last_name" in fields_to_write:
+            person_name = payload.get("PersonName", {"$type": PERSON_NAME_DATA})
+            if "first_name" in fields_to_write:
+                person_name["FirstName"] = record.get("first_name")
+            if "last_name" in fields_to_write:
+                person_name["LastName"] = record.get("last_name")
+            payload["PersonName"] = person_name
+
+        if "email" in fields_to_write:
+            email_payload = payload.get("Emails", collection(EMAIL_DATA_COLLECTION))
+
+            # Add email to existing emails if it's not already there
+            if record.get("email") and not any(email.get("Address") == record.get("email") for email in email_payload.get("$values", [])):
+                email_payload["$values"].append(email_data(record.get("email"), "_Primary", True))
+
+            # Emails of other records coalesced into this one
+            for email in record.get("_additional_emails", []):
+                if not any(normalize_email(existing_email.get("Address")) == normalize_email(email) for existing_email in email_payload["$values"]):
+                    email_payload["$values"].append(email_data(email, self.additional_email_type, False))
+
+            payload["Emails"] = email_payload
 
         # Handle company name
-        if record.get("company_id"):
+        if "company_id" in fields_to_write and record.get("company_id"):
 
-            company = self.get_organization_by_id(record.get("company_id"))
+            company_name = self.get_organization_name(record.get("company_id"))
 
-            if company and company.get("OrganizationName"):
-                company_name = company.get("OrganizationName")
+            if company_name:
                 payload["PrimaryOrganization"] = payload.get("PrimaryOrganization", {})
                 payload["PrimaryOrganization"].update({
-                    "$type": "Asi.Soa.Membership.DataContracts.PrimaryOrganizationInformationData, Asi.Contracts",
+                    "$type": PRIMARY_ORGANIZATION_DATA,
                     "OrganizationPartyId": record["company_id"],
                     "Name": company_name
                 })
 
         # Handle phone numbers
-        if "phone_numbers" in record and isinstance(record["phone_numbers"], list):
-            payload["Phones"] = payload.get("Phones", {
-                "$type": "Asi.Soa.Membership.DataContracts.PhoneDataCollection, Asi.Contracts",
-                "$values": []
-            })
-            if should_only_update_empty_fields:
-                phones = payload["Phones"]["$values"]
-            else:
-                phones = payload["Phones"]["$values"]
+        if "phone_numbers" in fields_to_write and isinstance(record.get("phone_numbers"), list):
+            payload["Phones"] = payload.get("Phones", collection(PHONE_DATA_COLLECTION))
+            phones = payload["Phones"]["$values"]
+            for new_phone in record["phone_numbers"]:
+                if not any(phone.get("Number") == new_phone["number"] for phone in phones):
+                    phones.append(phone_data(new_phone["number"], new_phone["type"]))
 
-                for new_phone in record["phone_numbers"]:
-                    if not any(phone.get("Number") == new_phone["number"] for phone in phones):
-                        phones.append(
-                            {
-                            "$type": "Asi.Soa.Membership.DataContracts.PhoneData, Asi.Contracts",
-                            "Number": new_phone["number"],
-                            "PhoneType": new_phone["type"],
-                            }
-                        )
+        # Handle addresses
+        if "addresses" in fields_to_write and isinstance(record.get("addresses"), list):
+            addresses = [
+                full_address_data(address, self.default_address_purpose)
+                for address in record["addresses"]
+            ]
+            payload["Addresses"] = collection(FULL_ADDRESS_DATA_COLLECTION, addresses)
 
+        LOGGER.debug("Finished preprocessing record: %s %s", record.get("first_name", ""), record.get("last_name", ""))
 
-            payload["Phones"].update({
-                "$values": phones
-            })
-
-        # Handle addresses
-        if "addresses" in record and isinstance(record["addresses"], list):
-            # If there are no addresses, IMIS returns an address in values with empty fields
-            non_nullish_addresses = [address for address in payload.get("Addresses", {}).get("$values", []) if address.get("line1")]
-            if should_only_update_empty_fields and non_nullish_addresses:
-                addresses = payload["Addresses"]["$values"]
-            else:
-                addresses = []
-
-                for address in record["addresses"]:
-                    addresses.append(
-                        {
-                            "$type": "Asi.Soa.Membership.DataContracts.FullAddressData, Asi.Contracts",
-                            "AddressPurpose": self.default_address_purpose,
-                            "Address": {
-                                "$type": "Asi.Soa.Membership.DataContracts.AddressData, Asi.Contracts",
-                                "AddressLines": [address.get("line1")],
-                                "CityName": address.get("city"),
-                                "PostalCode": address.get("postal_code"),
-                                "RegionName": address.get("state"),
-                                "CountryCode": address.get("country"),
-                            },
-                        }
-                    )
-
-            payload["Addresses"] = {
-                "$type": "Asi.Soa.Membership.DataContracts.FullAddressDataCollection, Asi.Contracts",
-                "$values": addresses,
-            }
-            LOGGER.info(f"Finished preprocessing record: {record.get('first_name', '')} {record.get('last_name', '')}")
+        if existing_contact is not None:
+            context["unchanged"] = normalize_entity(payload) == existing_contact
 
         return payload
 
@@ -257,25 +583,113 @@ class ActivitySink(IMISSink):
     name = "Activities"
     endpoint = "Activity"
     entity = "Activity"
+    _not_prefetched = object()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Contacts of the batch's emails resolved by prepare_batch, None for a miss
+        self._prefetched_parties = {}
+
+    @cached_property
+    def activity_mapping(self):
+        return ActivityMapping(
+            schema=self.schema,
+            field_mappings=self.config.get("activity_field_mappings"),
+            timezone_name=self.config.get("activity_timezone") or DEFAULT_ACTIVITY_TIMEZONE,
+        )
 
+    def _get_contact_from_email(self, email):
+        cached_contact = self.party_cache.get_by_email(email)
+        if cached_contact:
+            return cached_contact
 
+        prefetched_party = self._prefetched_parties.get(normalize_email(email), self._not_prefetched)
+        if prefetched_party is not self._not_prefetched:
+            return prefetched_party
+
+        LOGGER.debug("Checking for contact with email: %s", email)
 
-    def _get_contact_from_email(self, email):
-        LOGGER.info(f"Checking for contact with email: {email}")
-        
         search_response = self.request_api(
             "GET",
             endpoint=f"/Party?email={email}",
             headers=self.prepare_request_headers(),
         )
-        LOGGER.info(f"Response Status: {search_response.status_code}")
+        LOGGER.debug("Response Status: %s", search_response.status_code)
         search_response = search_response.json()
 
         if search_response["Items"]["$values"]:
-            LOGGER.info(f"Found contact via email: {email}")
+            LOGGER.debug("Found contact via email: %s", email)
+            self.party_cache.put(search_response["Items"]["$values"][0])
             return search_response["Items"]["$values"][0]
         return None
 
+    def on_record_read(self, record, context):
+        # A contact the activity depends on may still be buffered, the activity would wait for a batch that isn't full
+        if self.parallel_streams and not record.get("contact_id"):
+            self._target.submit_pending_contact(normalize_email(record.get("contact_email")))
+
+    def wait_for_contact(self, email):
+        """Wait for a contact record with the email still being upserted, draining its batch first."""
+        email = normalize_email(email)
+        if self.parallel_streams and self.pending_contacts.is_pending(email):
+            self._target.submit_pending_contact(email)
+            self.pending_contacts.wait(email)
+
+    def prepare_batch(self, records):
+        """Resolve the contacts of the batch's activities with multi-valued Party queries."""
+        self._prefetched_parties = {}
+        emails = set()
+        for record in records:
+            email = normalize_email(record.get("contact_email"))
+            if record.get("contact_id") or not email or "|" in email or email in self.negative_cache:
+                continue
+            if self.parallel_streams and self.pending_contacts.is_pending(email):
+                # Looked up by the record once its contact is written
+                self._target.submit_pending_contact(email)
+                continue
+            if self.party_cache.get_by_email(email):
+                continue
+            indexed = self.identity_index.get("email", email) if self.identity_index else None
+            if indexed and indexed[1] <= self.identity_index_trust_seconds:
+                continue
+            emails.add(email)
+        if not emails:
+            return
+
+        LOGGER.info(f"Prefetching contacts for {len(emails)} distinct email(s)")
+        try:
+            parties = self.search_parties("email", sorted(emails))
+        except (FatalAPIError, RetriableAPIError) as e:
+            LOGGER.warning(f"Batched contact lookup failed, falling back to per-record lookups: {e}")
+            return
+        # Emails without a match stay resolved as misses for the batch
+        prefetched_parties = dict.fromkeys(emails)
+        for party in parties:
+            for email in self.get_party_values(party, "email"):
+                if email in prefetched_parties and prefetched_parties[email] is None:
+                    prefetched_parties[email] = party
+        self._prefetched_parties = prefetched_parties
+
+    def finish_batch(self):
+        self._prefetched_parties = {}
+
+    def _get_indexed_party_id(self, email):
+        """Return the PartyId the identity index holds for an email, verified once it's past the trust window."""
+        if not self.identity_index:
+            return None
+        indexed = self.identity_index.get("email", email)
+        if not indexed:
+            return None
+        party_id, age = indexed
+        if age <= self.identity_index_trust_seconds:
+            return party_id
+
+        contact = self.get_party_by_id(party_id)
+        if contact and normalize_email(email) in self.get_party_values(contact, "email"):
+            self.identity_index.put("email", email, party_id)
+            return party_id
+        self.identity_index.discard("email", email)
+        return None
 
     def _get_party_id(self, record: dict) -> str:
         """Get party ID from record."""
@@ -284,90 +698,51 @@ class ActivitySink(IMISSink):
         elif record.get("contact_email"):
             contact_email = record.get("contact_email")
 
+            indexed_party_id = self._get_indexed_party_id(contact_email)
+            if indexed_party_id:
+                return indexed_party_id
+
             matching_contact = self._get_contact_from_email(contact_email)
 
             if matching_contact == None:
-                raise InvalidPayloadError(f"No contact found with email: {contact_email}")
+                email = normalize_email(contact_email)
+                self.negative_cache.add(email)
+                self.negative_cache.count_failure(email)
+                raise UnknownContactError(f"No contact found with email: {contact_email}")
             
             if matching_contact.get("PartyId"):
+                if self.identity_index:
+                    self.identity_index.put("email", contact_email, matching_contact.get("PartyId"))
                 return matching_contact.get("PartyId")
             else:
                 raise InvalidPayloadError(f"Contact found with email: {contact_email} but no PartyId found.")
         else:
             raise InvalidPayloadError("contact_id or contact_email is required for activities and cannot be null.")
 
+    def get_fast_failure(self, record):
+        """Fail activities whose contact email had no match, without searching it again."""
+        if record.get("contact_id"):
+            return None
+        email = normalize_email(record.get("contact_email"))
+        # A contact still pending may be created with the email, the record's only wait for it
+        self.wait_for_contact(email)
+        if email in self.negative_cache:
+            self.negative_cache.count_failure(email)
+            return UnknownContactError(f"No contact found with email: {record.get('contact_email')}")
+        return None
+
     def preprocess_record(self, record: dict, context: dict) -> dict:
 
-        LOGGER.info(f"Preprocessing record: {record.get('title', '')}")
+        LOGGER.debug("Preprocessing record: %s", record.get("title", ""))
         party_id = self._get_party_id(record)
-            
-
-
-        # Hardcode current datetime in Eastern timezone (as per PHP code requirement)
-        eastern = pytz.timezone('America/Toronto')
-        now = datetime.now(eastern)
-
-        # Create the base activity payload with required type
-        payload = {
-            "$type": "Asi.Soa.Core.DataContracts.GenericEntityData, Asi.Contracts",
-            "properties": {
-                "$values": [
-                {
-                    "Name": "PartyId",
-                    "Value": party_id
-                },
-                {
-                    "Name": "TRANSACTION_DATE",
-                    "Value": now.strftime("%Y-%m-%dT%H:%M:%S")
-                }
-                ]
-            }
-        }
-
-        LOGGER.info(f"Built base payload: {payload}")
-
-
-        # Map standard fields from the record
-        field_mappings = {
-            "id": "ID",
-            "activity_datetime": "ACTIVITY_DATE",
-            "duration_seconds": "DURATION",
-            "contact_id": "CONTACT_ID",
-            "company_id": "COMPANY_ID",
-            "deal_id": "DEAL_ID",
-            "owner_id": "OWNER_ID",
-            "type": "ACTIVITY_TYPE",
-            "title": "TITLE",
-            "description": "DESCRIPTION",
-            "note": "NOTE",
-            "location": "LOCATION",
-            "status": "STATUS",
-            "start_datetime": "START_DATE",
-            "end_datetime": "END_DATE"
-        }
-
-        # Add mapped fields to payload
-        for source_field, target_field in field_mappings.items():
-            if source_field in record and record[source_field]:
-                payload["properties"]["$values"].append({
-                    "Name": target_field,
-                    "Value": record[source_field]
-                })
-
-        # Handle custom fields (UF1-UF7)
-        if "custom_fields" in record and record["custom_fields"]:
-            for custom_field in record["custom_fields"]:
-                payload["properties"]["$values"].append({
-                    "Name": custom_field["name"],
-                    "Value": custom_field["value"]
-                })
-
+        payload = self.activity_mapping.build(record, party_id)
+        LOGGER.debug("Built payload: %s", payload)
         return payload
 
     def upsert_record(self, record: dict, context: dict):
         """Create activity record - no updates supported."""
         state_dict = dict()
-        LOGGER.info(f"Upserting record...")
+        LOGGER.debug("Upserting record...")
         response = self.request_api(
             "POST",
             request_data=record,
@@ -1,9 +1,22 @@
 """IMIS target class."""
 
+import time
+from functools import cached_property
+
+import click
 from hotglue_singer_sdk import typing as th
+from hotglue_singer_sdk.helpers._classproperty import classproperty
 from hotglue_singer_sdk.target_sdk.target import TargetHotglue
 from hotglue_singer_sdk.helpers.capabilities import AlertingLevel
 
+from target_imis.auth import IMISAuth
+from target_imis.cache import NegativeCache, PartyCache
+from target_imis.circuit_breaker import CircuitBreaker
+from target_imis.metrics import Metrics
+from target_imis.pending import PendingContacts
+from target_imis.rate_limiter import AdaptiveRateLimiter
+from target_imis.reference_data import ReferenceData
+from target_imis.transport import DEFAULT_POOL_SIZE, IMISTransport
 from target_imis.sinks import (
     ContactsSink,
     ActivitySink,
@@ -33,6 +46,256 @@ class TargetIMIS(TargetHotglue):
             parse_env_config=parse_env_config,
             validate_config=validate_config,
         )
+        self._progress_logged_at = time.monotonic()
+        self._progress_records = 0
+
+    @cached_property
+    def party_cache(self):
+        """Party documents shared by every sink of the run."""
+        return PartyCache(
+            max_bytes=int(float(self.config.get("party_cache_max_mb", 64)) * 1024 * 1024),
+            ttl=float(self.config.get("party_cache_ttl", 900)),
+        )
+
+    @cached_property
+    def negative_cache(self):
+        """Contact emails known to have no Party, shared by every sink of the run."""
+        return NegativeCache(
+            max_entries=int(self.config.get("negative_cache_max_entries", 10000)),
+            ttl=float(self.config.get("negative_cache_ttl", 900)),
+        )
+
+    @cached_property
+    def pending_contacts(self):
+        """Contacts queued for upsert, which activities wait for when streams run in parallel."""
+        return PendingContacts(timeout=float(self.config.get("pending_contact_timeout", 300)))
+
+    @cached_property
+    def metrics(self):
+        """Request and processing-time metrics of the run."""
+        return Metrics(interval=float(self.config.get("metrics_interval", 60)))
+
+    @cached_property
+    def transport(self):
+        """HTTP session every sink sends its requests through."""
+        max_workers = int(self.config.get("max_workers") or 1)
+        # Adapts to throttling either way, the configured rate is only a ceiling
+        rate_limiter = AdaptiveRateLimiter(max_rate=float(self.config.get("max_requests_per_second") or 0))
+        self.metrics.gauges["rate_limiter"] = rate_limiter.metrics
+        cassette = None
+        if self.config.get("http_cassette_mode"):
+            from target_imis.cassette import Cassette
+
+            cassette = Cassette(
+                self.config["http_cassette_path"],
+                self.config["http_cassette_mode"],
+                latency_scale=float(self.config.get("http_cassette_latency_scale", 1)),
+            )
+        return IMISTransport(
+            pool_size=max(DEFAULT_POOL_SIZE, max_workers * len(self.SINK_TYPES)),
+            gzip=self.config.get("http_gzip", True),
+            rate_limiter=rate_limiter,
+            metrics=self.metrics,
+            cassette=cassette,
+        )
+
+    @cached_property
+    def auth(self):
+        """Access token shared by every sink."""
+        return IMISAuth(dict(self.config), self.transport)
+
+    @cached_property
+    def circuit_breaker(self):
+        """Error rate of the run's requests, which stops retries when it spikes."""
+        return CircuitBreaker(
+            error_rate=float(self.config.get("circuit_breaker_error_rate", 0.5)),
+            min_requests=int(self.config.get("circuit_breaker_min_requests", 20)),
+            cooldown=float(self.config.get("circuit_breaker_cooldown", 60)),
+        )
+
+    @cached_property
+    def dead_letters(self):
+        """Spool of the records the run failed to write, when `dead_letter_path` is set."""
+        if not self.config.get("dead_letter_path"):
+            return None
+        from target_imis.dead_letter import DeadLetterSpool
+
+        return DeadLetterSpool(self.config["dead_letter_path"])
+
+    @cached_property
+    def identity_index(self):
+        """Index of known PartyIds persisted across runs, when `identity_index_path` is set."""
+        if not self.config.get("identity_index_path"):
+            return None
+        # Imported on use, so runs without an index don't load sqlite3
+        from target_imis.identity_index import IdentityIndex
+
+        return IdentityIndex(self.config["identity_index_path"], self.config["site_url"].rstrip("/"))
+
+    @cached_property
+    def journal(self):
+        """Journal of committed upserts, to resume an interrupted run, when `journal_path` is set."""
+        if not self.config.get("journal_path"):
+            return None
+        from target_imis.journal import Journal
+
+        return Journal(self.config["journal_path"], self.config["site_url"].rstrip("/"))
+
+    @cached_property
+    def reference_data(self):
+        """Reference data of the site, shared by every sink and, with `reference_cache_dir`, across runs."""
+        return ReferenceData(
+            self.config["site_url"].rstrip("/"),
+            directory=self.config.get("reference_cache_dir"),
+            ttl=float(self.config.get("reference_cache_ttl", 86400)),
+            refresh=bool(self.config.get("reference_cache_refresh", False)),
+        )
+
+    def log_progress(self, force=False) -> None:
+        """Log record counts and throughput, at most every `log_progress_interval` seconds."""
+        interval = float(self.config.get("log_progress_interval", 30))
+        now = time.monotonic()
+        if not force and (not interval or now - self._progress_logged_at < interval):
+            return
+
+        stream_counts = []
+        records = 0
+        for sink in list(self._sinks_active.values()) + self._sinks_to_clear:
+            summary = ((sink.latest_state or {}).get("summary") or {}).get(sink.name)
+            if not summary:
+                continue
+            succeeded = summary.get("success", 0) + summary.get("updated", 0) + summary.get("existing", 0)
+            records += succeeded + summary.get("fail", 0) + sink.skipped_duplicates
+            stream_count = f"{sink.name}: {succeeded} ok, {summary.get('fail', 0)} failed"
+            # Duplicates are only counted here, not logged one by one
+            duplicates = summary.get("existing", 0) + sink.skipped_duplicates
+            if duplicates:
+                stream_count += f", {duplicates} already written"
+            stream_counts.append(stream_count)
+
+        rate = (records - self._progress_records) / max(now - self._progress_logged_at, 1e-6)
+        self._progress_logged_at = now
+        self._progress_records = records
+        message = f"Progress: {records} records ({rate:.1f}/s)"
+        if stream_counts:
+            message += "; " + "; ".join(stream_counts)
+        if "party_cache" in self.__dict__:
+            stats = self.party_cache.stats()
+            lookups = stats["hits"] + stats["misses"]
+            message += f"; party cache hit rate {stats['hits'] / lookups:.0%}" if lookups else ""
+        self.logger.info(message)
+
+    def log_unknown_contacts(self, limit=20) -> None:
+        """Log the records failed for unknown contact emails, once per email."""
+        failures = self.negative_cache.failures()
+        if not failures and not self.negative_cache.other_failures:
+            return
+        records = sum(count for _, count in failures) + self.negative_cache.other_failures
+        message = f"{records} records failed for {len(failures)} unknown contact email(s): "
+        message += ", ".join(f"{email} ({count})" for email, count in failures[:limit])
+        if len(failures) > limit:
+            message += f" and {len(failures) - limit} more"
+        if self.negative_cache.other_failures:
+            message += f"; {self.negative_cache.other_failures} more records for other emails"
+        self.logger.warning(message)
+
+    def _process_endofpipe(self) -> None:
+        super()._process_endofpipe()
+        self.log_progress(force=True)
+        if self.__dict__.get("identity_index"):
+            self.identity_index.close()
+        if self.__dict__.get("journal"):
+            self.journal.close()
+        if self.__dict__.get("dead_letters"):
+            self.dead_letters.close()
+            if self.dead_letters.count:
+                self.logger.warning(f"{self.dead_letters.count} failed records written to {self.dead_letters.path}")
+        if "circuit_breaker" in self.__dict__ and self.circuit_breaker.trips:
+            self.logger.warning(f"Circuit breaker tripped {self.circuit_breaker.trips} times")
+        if "transport" in self.__dict__:
+            self.transport.close()
+            if self.transport.rate_limiter:
+                self.logger.info(f"Request rate limiter: {self.transport.rate_limiter.metrics()}")
+        if "party_cache" in self.__dict__:
+            stats = self.party_cache.stats()
+            self.logger.info(
+                f"Party cache: {stats['hits']} hits, {stats['misses']} misses, "
+                f"{stats['entries']} parties cached ({stats['bytes']} bytes)"
+            )
+        if "pending_contacts" in self.__dict__ and self.pending_contacts.waits:
+            self.logger.info(f"Activities waited for {self.pending_contacts.waits} pending contacts")
+        if "negative_cache" in self.__dict__:
+            self.log_unknown_contacts()
+        if "metrics" in self.__dict__:
+            if "party_cache" in self.__dict__:
+                self.metrics.gauges["party_cache"] = self.party_cache.stats
+            self.metrics.emit(summary=True)
+
+    def submit_pending_contact(self, email) -> None:
+        """Drain the Contacts sinks buffering a record with the email, so activities don't wait on a batch that isn't full.
+
+        Called from the reading thread when an activity is read, and from
+        the Activities stream thread before it waits for the contact: the
+        reading thread may itself be blocked behind that stream.
+        """
+        if not self.pending_contacts.is_pending(email):
+            return
+        for sink in list(self._sinks_active.values()):
+            if not isinstance(sink, ContactsSink):
+                continue
+            with sink._drain_lock:
+                if sink.is_buffered(email):
+                    self.drain_one(sink)
+
+    def drain_one(self, sink) -> None:
+        if not sink:
+            return
+        with sink._drain_lock:
+            super().drain_one(sink)
+
+    def drain_all(self, is_endofpipe: bool = False) -> None:
+        # Buffered sinks have to flush before the SDK snapshots the state it emits
+        sinks = [sink for sink in list(self._sinks_active.values()) + self._sinks_to_clear if sink]
+        drained_sinks = [sink for sink in sinks if sink.current_size]
+        for sink in drained_sinks:
+            self.drain_one(sink)
+        # So do the streams running in parallel, all of them, whichever was drained
+        for sink in sinks:
+            if sink.parallel_streams or sink in drained_sinks:
+                sink.wait_for_stream()
+                self._merge_sink_state(sink)
+        super().drain_all(is_endofpipe)
+
+    def _merge_sink_state(self, sink) -> None:
+        sink_state = sink.latest_state or {}
+        if self.streaming_job:
+            latest_state = self._latest_state.setdefault("target", {})
+        else:
+            latest_state = self._latest_state
+        for key, value in sink_state.items():
+            if isinstance(value, dict):
+                latest_state.setdefault(key, {}).update(value)
+
+    @classproperty
+    def cli(cls):
+        """The SDK's command, with a `--profile` option writing a cProfile report of the run."""
+        command = vars(TargetHotglue)["cli"].fget(cls)
+        run = command.callback
+
+        def callback(profile=None, **kwargs):
+            if not profile:
+                return run(**kwargs)
+            from target_imis.profiling import run_profiled
+
+            return run_profiled(profile, run, **kwargs)
+
+        command.params.append(click.Option(
+            ["--profile"],
+            type=click.Path(dir_okay=False),
+            help="Profile the run and write its stats to this file, and a text report to the file with a .txt suffix.",
+        ))
+        command.callback = callback
+        return command
 
     config_jsonschema = th.PropertiesList(
         th.Property("username", th.StringType, required=True),
@@ -0,0 +1,50 @@
+"""HTTP transport shared by the IMIS sinks."""
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Connections kept alive to the iMIS host when nothing runs in parallel
+DEFAULT_POOL_SIZE = 10
+
+
+class IMISTransport:
+    """Pooled, keep-alive HTTP session every request to the iMIS host goes through."""
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, gzip=True, rate_limiter=None, metrics=None, cassette=None):
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics
+        # Records the exchanges, or answers them from a recording instead of the network
+        self.cassette = cassette
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Accept-Encoding"] = "gzip, deflate" if gzip else "identity"
+
+    def request(self, method, url, **kwargs):
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        started = time.perf_counter()
+        try:
+            if self.cassette and self.cassette.mode == "replay":
+                response = self.cassette.replay(method, url, params=kwargs.get("params"), data=kwargs.get("data"))
+            else:
+                response = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            if self.metrics:
+                self.metrics.observe_request(method, url, time.perf_counter() - started)
+            raise
+        seconds = time.perf_counter() - started
+        if self.cassette and self.cassette.mode == "record":
+            self.cassette.record(response, seconds)
+        if self.metrics:
+            self.metrics.observe_request(method, url, seconds, response.status_code)
+        if self.rate_limiter:
+            self.rate_limiter.observe(response)
+        return response
+
+    def close(self):
+        self.session.close()
+        if self.cassette:
+            self.cassette.close()
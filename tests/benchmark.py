@@ -0,0 +1,245 @@
+"""Offline throughput benchmark of target-imis against the fake iMIS server.
+
+Feeds a synthetic Singer stream through `TargetIMIS` and reports records/sec,
+requests per record, p50/p99 request latency, peak RSS and the time a fresh
+interpreter takes to import the target. Run it with:
+
+    python -m tests.benchmark --contacts 10000 --activities 10000
+
+`--output` writes the report as JSON, and `--compare` exits non-zero when a
+report regresses past `--max-regression` against a saved baseline.
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from tests.fake_imis import FakeIMIS, FakeIMISServer
+
+CONTACT_SCHEMA = {
+    "type": ["object", "null"],
+    "properties": {
+        "first_name": {"type": ["string", "null"]},
+        "externalId": {"type": ["string", "null"]},
+        "last_name": {"type": ["string", "null"]},
+        "email": {"type": ["string", "null"]},
+        "phone_numbers": {"type": ["array", "null"], "items": {"type": ["object", "string", "null"]}},
+        "company_id": {"type": ["string", "null"]},
+        "addresses": {"type": ["array", "null"], "items": {"type": ["object", "null"]}},
+    },
+}
+ACTIVITY_SCHEMA = {
+    "type": ["object", "null"],
+    "properties": {
+        "contact_email": {"type": ["string", "null"]},
+        "title": {"type": ["string", "null"]},
+        "description": {"type": ["string", "null"]},
+        "custom_fields": {"type": ["array", "null"], "items": {"type": ["object", "string", "null"]}},
+    },
+}
+ORGANIZATIONS = 20
+# Request latencies kept for the percentiles, a uniform sample so long runs don't grow the RSS they measure
+LATENCY_SAMPLE_SIZE = 10000
+# Report fields where a higher value is a regression, the others regress when they drop
+HIGHER_IS_WORSE = ("requests_per_record", "p50_latency_ms", "p99_latency_ms", "peak_rss_mb", "import_ms")
+
+
+def write_stream(path, contacts, activities, duplicate_every=0):
+    """Write a synthetic Singer stream of Contacts followed by Activities on them."""
+    with open(path, "w") as stream:
+        stream.write(json.dumps({"type": "SCHEMA", "stream": "Contacts", "schema": CONTACT_SCHEMA, "key_properties": []}) + "\n")
+        for index in range(contacts):
+            person = index % duplicate_every if duplicate_every else index
+            stream.write(json.dumps({"type": "RECORD", "stream": "Contacts", "record": {
+                "first_name": f"First{person}",
+                "last_name": f"Last{person}",
+                "email": f"user{person}@example.com",
+                "externalId": f"EXT{index}",
+                "phone_numbers": [{"number": f"555{person:07d}", "type": "mobile"}],
+                "company_id": str(100 + person % ORGANIZATIONS),
+                "addresses": [{"line1": f"{person} Main St", "city": "Toronto", "postal_code": "M5V 2T6", "state": "ON", "country": "CA"}],
+            }}) + "\n")
+        stream.write(json.dumps({"type": "STATE", "value": {}}) + "\n")
+        if not activities:
+            return
+        stream.write(json.dumps({"type": "SCHEMA", "stream": "Activities", "schema": ACTIVITY_SCHEMA, "key_properties": []}) + "\n")
+        for index in range(activities):
+            stream.write(json.dumps({"type": "RECORD", "stream": "Activities", "record": {
+                "contact_email": f"user{index % max(contacts, 1)}@example.com",
+                "title": f"Activity {index}",
+                "description": "Synthetic benchmark activity",
+                "custom_fields": [{"name": "UF1", "value": str(index)}],
+            }}) + "\n")
+        stream.write(json.dumps({"type": "STATE", "value": {}}) + "\n")
+
+
+def _serve(server_options, ready):
+    server = FakeIMISServer(FakeIMIS(organizations=ORGANIZATIONS, **server_options))
+    ready.put(server.url)
+    server.serve_forever()
+
+
+@contextlib.contextmanager
+def fake_imis_process(**server_options):
+    """Serve a fake iMIS tenant from a child process, so it stays out of the target's RSS and GIL."""
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(server_options, ready), daemon=True)
+    process.start()
+    try:
+        yield ready.get(timeout=30)
+    finally:
+        process.terminate()
+        process.join()
+
+
+class _LatencySample:
+    """Reservoir sample of request latencies."""
+
+    def __init__(self, size=LATENCY_SAMPLE_SIZE):
+        self.size = size
+        self.seen = 0
+        self.values = []
+        self._random = random.Random(0)
+
+    def add(self, value):
+        self.seen += 1
+        if len(self.values) < self.size:
+            self.values.append(value)
+            return
+        index = self._random.randrange(self.seen)
+        if index < self.size:
+            self.values[index] = value
+
+
+def _percentile(values, percentile):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percentile / 100 * (len(values) - 1))))]
+
+
+def measure_import_ms(runs=3):
+    """Return the fastest of `runs` cold imports of the target, each in a fresh interpreter, in milliseconds."""
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", "import time; started = time.perf_counter(); import target_imis.target; print(time.perf_counter() - started)"],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        timings.append(float(output.splitlines()[-1]) * 1000)
+    return round(min(timings), 1)
+
+
+def run_benchmark(contacts=1000, activities=1000, duplicate_every=0, latency=0.0, error_rate=0.0,
+                  throttle_rate=0.0, config=None):
+    """Run the target over a synthetic stream and return its report."""
+    from target_imis.target import TargetIMIS
+
+    records = contacts + activities
+    with tempfile.TemporaryDirectory() as directory, fake_imis_process(
+        latency=latency, error_rate=error_rate, throttle_rate=throttle_rate
+    ) as url:
+        stream_path = os.path.join(directory, "data.singer")
+        config_path = os.path.join(directory, "config.json")
+        write_stream(stream_path, contacts, activities, duplicate_every)
+        with open(config_path, "w") as config_file:
+            json.dump({"username": "benchmark", "password": "benchmark", "site_url": url, **(config or {})}, config_file)
+
+        target = TargetIMIS(config=[config_path])
+        latencies = _LatencySample()
+        target.transport.session.hooks["response"].append(
+            lambda response, *args, **kwargs: latencies.add(response.elapsed.total_seconds())
+        )
+        started = time.perf_counter()
+        with open(stream_path) as stream, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            target.listen(stream)
+        elapsed = time.perf_counter() - started
+        request_counts = requests.get(f"{url}/_stats").json()
+
+    requests_sent = sum(request_counts.values())
+    return {
+        "records": records,
+        "seconds": round(elapsed, 3),
+        "records_per_second": round(records / elapsed, 1),
+        "requests": requests_sent,
+        "requests_per_record": round(requests_sent / max(records, 1), 3),
+        "p50_latency_ms": round(_percentile(latencies.values, 50) * 1000, 2),
+        "p99_latency_ms": round(_percentile(latencies.values, 99) * 1000, 2),
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+        "request_counts": request_counts,
+    }
+
+
+def compare(report, baseline, max_regression):
+    """Return the report fields that regressed more than `max_regression` (a ratio) against the baseline."""
+    regressions = []
+    for key in ("records_per_second",) + HIGHER_IS_WORSE:
+        before, after = baseline.get(key), report.get(key)
+        if not before or after is None:
+            continue
+        change = (after - before) / before
+        if key in HIGHER_IS_WORSE and change > max_regression or key not in HIGHER_IS_WORSE and -change > max_regression:
+            regressions.append(f"{key}: {before} -> {after} ({change:+.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark target-imis against a fake iMIS server.")
+    parser.add_argument("--contacts", type=int, default=10000)
+    parser.add_argument("--activities", type=int, default=10000)
+    parser.add_argument("--duplicate-every", type=int, default=0, help="Reuse contact identities modulo this number.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the server adds to every request.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with a 500.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests throttled with a 429.")
+    parser.add_argument(
+        "--config",
+        type=json.loads,
+        # Unthrottled by default, so the request rate limit doesn't mask regressions
+        default={"max_requests_per_second": 0},
+        help="JSON object used as the target config, on top of the fake server credentials.",
+    )
+    parser.add_argument("--import-runs", type=int, default=3, help="Cold imports timed for `import_ms`, 0 to skip them.")
+    parser.add_argument("--output", help="Write the report to this JSON file.")
+    parser.add_argument("--compare", help="Baseline report to compare against.")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Tolerated regression ratio against the baseline.")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(
+        contacts=args.contacts,
+        activities=args.activities,
+        duplicate_every=args.duplicate_every,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        config=args.config,
+    )
+    if args.import_runs:
+        report["import_ms"] = measure_import_ms(args.import_runs)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(report, json.load(baseline), args.max_regression)
+        if regressions:
+            print("Performance regressions against the baseline:\n" + "\n".join(regressions), file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,33 @@
 """Test Configuration."""
 
-pytest_plugins = ("singer_sdk.testing.pytest_plugin",)
+import json
+
+import pytest
+
+from tests.fake_imis import FakeIMIS, FakeIMISServer
+
+
+@pytest.fixture
+def fake_imis():
+    """Fake iMIS server with a few organizations, running for the duration of a test."""
+    server = FakeIMISServer(FakeIMIS(organizations=5)).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def target_config(tmp_path, fake_imis):
+    """Write a target config pointing at the fake server and return a function adding settings to it."""
+
+    def write(**settings):
+        path = tmp_path / "config.json"
+        path.write_text(json.dumps({
+            "username": "test",
+            "password": "test",
+            "site_url": fake_imis.url,
+            "max_requests_per_second": 0,
+            **settings,
+        }))
+        return str(path)
+
+    return write
@@ -0,0 +1,268 @@
+"""Local stand-in for the iMIS REST API, used by the tests and the benchmark suite.
+
+Implements the endpoints the target calls (`/Token`, `Party` search, GET,
+POST and PUT, `Organization`, `AddressPurpose` and `Activity`) against an
+in-memory tenant, with injectable latency, server errors and throttling.
+`GET /_stats` returns the number of requests served per endpoint.
+"""
+
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+ACCESS_TOKEN = "fake-token"
+PAGE_LIMIT_MAX = 500
+SEARCH_KEYS = ("id", "email", "firstname", "lastname")
+
+
+def _collection(type_name, values):
+    return {"$type": type_name, "$values": values}
+
+
+def _paged(items, offset, limit, total):
+    next_offset = offset + len(items)
+    return {
+        "$type": "Asi.Soa.Core.DataContracts.PagedResult, Asi.Contracts",
+        "Items": _collection("System.Collections.Generic.List`1[[System.Object, mscorlib]], mscorlib", items),
+        "Offset": offset,
+        "Limit": limit,
+        "Count": len(items),
+        "TotalCount": total,
+        "NextOffset": next_offset if next_offset < total else 0,
+        "HasNext": next_offset < total,
+    }
+
+
+def _search_values(party, key):
+    if key == "id":
+        values = [party.get("Id")]
+    elif key == "email":
+        values = [email.get("Address") for email in (party.get("Emails") or {}).get("$values", [])]
+    elif key == "firstname":
+        values = [(party.get("PersonName") or {}).get("FirstName")]
+    else:
+        values = [(party.get("PersonName") or {}).get("LastName")]
+    return {str(value).lower() for value in values if value}
+
+
+class FakeIMIS:
+    """In-memory iMIS tenant with injectable latency, errors and throttling."""
+
+    def __init__(self, latency=0.0, error_rate=0.0, throttle_rate=0.0, organizations=0, seed=0, poison=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        # Request bodies containing this text always fail, like payloads iMIS can't save
+        self.poison = poison
+        self.throttle_rate = throttle_rate
+        self.parties = {}
+        self.activities = []
+        self.activity_payloads = {}
+        self.request_counts = {}
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1000)
+        self._index = {key: {} for key in SEARCH_KEYS}
+        self._lock = threading.Lock()
+        for number in range(100, 100 + organizations):
+            self._store(str(number), {
+                "$type": "Asi.Soa.Membership.DataContracts.OrganizationData, Asi.Contracts",
+                "OrganizationName": f"Organization {number}",
+            })
+
+    def count(self, method, resource):
+        key = f"{method} {resource}"
+        with self._lock:
+            self.request_counts[key] = self.request_counts.get(key, 0) + 1
+
+    def roll(self, rate):
+        if not rate:
+            return False
+        with self._lock:
+            return self._random.random() < rate
+
+    def _store(self, party_id, payload):
+        party = dict(payload, Id=party_id, PartyId=party_id)
+        with self._lock:
+            previous = self.parties.get(party_id)
+            for key in SEARCH_KEYS:
+                if previous is not None:
+                    for value in _search_values(previous, key):
+                        self._index[key][value].discard(party_id)
+                for value in _search_values(party, key):
+                    self._index[key].setdefault(value, set()).add(party_id)
+            self.parties[party_id] = party
+        return party
+
+    def search(self, params):
+        """Return the parties matching every filter; `in:a|b` filters match any of their values."""
+        with self._lock:
+            party_ids = None
+            for key, values in params.items():
+                key = key.lower()
+                if key not in SEARCH_KEYS:
+                    continue
+                value = values[0]
+                wanted = value[3:].split("|") if value.startswith("in:") else [value]
+                matches = set()
+                for wanted_value in wanted:
+                    matches.update(self._index[key].get(wanted_value.lower(), ()))
+                party_ids = matches if party_ids is None else party_ids & matches
+            if party_ids is None:
+                party_ids = self.parties.keys()
+            return [self.parties[party_id] for party_id in sorted(party_ids, key=int)]
+
+    def create_party(self, payload):
+        return self._store(str(next(self._ids)), payload)
+
+    def update_party(self, party_id, payload):
+        if party_id not in self.parties:
+            return None
+        return self._store(party_id, payload)
+
+    def create_activity(self, payload):
+        activity_id = str(next(self._ids))
+        with self._lock:
+            self.activities.append(activity_id)
+            self.activity_payloads[activity_id] = payload
+        return dict(payload, Identity={
+            "$type": "Asi.Soa.Core.DataContracts.IdentityData, Asi.Contracts",
+            "EntityTypeName": "Activity",
+            "IdentityElements": _collection(
+                "System.Collections.ObjectModel.Collection`1[[System.String, mscorlib]], mscorlib",
+                [activity_id],
+            ),
+        })
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes, Nagle would hold the body for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=None, headers=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method):
+        imis = self.server.imis
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        segments = [segment for segment in url.path.split("/") if segment]
+        if segments and segments[0].lower() == "api":
+            segments = segments[1:]
+        resource = segments[0].lower() if segments else ""
+
+        if resource == "_stats":
+            return self._send(200, imis.request_counts)
+
+        imis.count(method, segments[0] + ("/{id}" if len(segments) > 1 else "") if segments else "/")
+        if imis.latency:
+            time.sleep(imis.latency)
+
+        if resource == "token" and method == "POST":
+            return self._send(200, {"access_token": ACCESS_TOKEN, "token_type": "bearer", "expires_in": 3600})
+        if self.headers.get("Authorization") != f"Bearer {ACCESS_TOKEN}":
+            return self._send(401, {"Message": "Authorization has been denied for this request."})
+        if imis.roll(imis.throttle_rate):
+            return self._send(429, {"Message": "Too many requests"}, {"Retry-After": "1"})
+        if imis.roll(imis.error_rate) or imis.poison and imis.poison.encode() in body:
+            return self._send(500, {"Message": "An error occurred. Please contact the administrator."})
+
+        payload = json.loads(body) if body else None
+
+        if resource == "addresspurpose" and method == "GET":
+            return self._send(200, _paged([
+                {"Name": "Address", "IsDefaultAddress": False},
+                {"Name": "Home Address", "IsDefaultAddress": True},
+            ], 0, PAGE_LIMIT_MAX, 2))
+
+        if resource in ("party", "organization") and method == "GET" and len(segments) == 1:
+            matches = imis.search(params)
+            if resource == "organization":
+                matches = [party for party in matches if "OrganizationName" in party]
+            offset = int(params.get("offset", ["0"])[0])
+            limit = min(int(params.get("limit", ["100"])[0]), PAGE_LIMIT_MAX)
+            return self._send(200, _paged(matches[offset:offset + limit], offset, limit, len(matches)))
+
+        if resource == "party" and method == "GET" and len(segments) == 2:
+            party = imis.parties.get(segments[1])
+            return self._send(200, party) if party else self._send(404, {"Message": "Not found"})
+
+        if resource == "party" and method == "POST" and len(segments) == 1:
+            return self._send(201, imis.create_party(payload))
+
+        if resource == "party" and method == "PUT" and len(segments) == 2:
+            party = imis.update_party(segments[1], payload)
+            return self._send(200, party) if party else self._send(404, {"Message": "Not found"})
+
+        if resource == "activity" and method == "POST" and len(segments) == 1:
+            return self._send(201, imis.create_activity(payload))
+
+        return self._send(404, {"Message": f"No route for {method} {url.path}"})
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+
+class FakeIMISServer(ThreadingHTTPServer):
+    """Threaded HTTP server serving a `FakeIMIS` tenant."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, imis=None, host="127.0.0.1", port=0):
+        super().__init__((host, port), _Handler)
+        self.imis = imis or FakeIMIS()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake iMIS tenant.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with a 500.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests throttled with a 429.")
+    parser.add_argument("--organizations", type=int, default=0, help="Organizations seeded from id 100.")
+    args = parser.parse_args()
+    imis = FakeIMIS(args.latency, args.error_rate, args.throttle_rate, args.organizations)
+    server = FakeIMISServer(imis, args.host, args.port)
+    print(f"Serving a fake iMIS tenant on {server.url}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
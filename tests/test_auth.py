@@ -0,0 +1,16 @@
+"""Tests of the iMIS token authentication."""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from target_imis.auth import IMISAuth
+
+
+def test_concurrent_first_requests_share_one_token(fake_imis):
+    auth = IMISAuth({"site_url": fake_imis.url, "username": "test", "password": "test"})
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        headers = list(executor.map(lambda _: auth(), range(64)))
+
+    assert len(set(headers)) == 1
+    assert headers[0].startswith("Bearer ")
+    assert fake_imis.imis.request_counts["POST Token"] == 1
@@ -0,0 +1,58 @@
+"""Tests of the caches shared by the sinks."""
+
+import json
+import time
+
+from target_imis.cache import PartyCache
+
+
+def party(party_id, *emails):
+    return {"Id": party_id, "PartyId": party_id, "Emails": {"$values": [{"Address": email} for email in emails]}}
+
+
+def test_party_taking_an_email_over_leaves_the_other_party_cached_by_id():
+    cache = PartyCache()
+    cache.put(party("1", "shared@example.com", "one@example.com"))
+
+    cache.put(party("2", "Shared@example.com"))
+
+    assert cache.get_by_email("shared@example.com")["Id"] == "2"
+    assert cache.get_by_id("1")["Id"] == "1"
+    assert cache.get_by_email("one@example.com")["Id"] == "1"
+    assert cache.stats()["entries"] == 2
+
+
+def test_newer_copy_of_a_party_replaces_the_older_one():
+    cache = PartyCache()
+    cache.put(party("1", "old@example.com"))
+
+    cache.put(party("1", "new@example.com"))
+
+    assert cache.get_by_email("old@example.com") is None
+    assert cache.get_by_email("new@example.com")["Id"] == "1"
+    assert cache.stats()["entries"] == 1
+
+
+def test_parties_expire_after_the_ttl():
+    cache = PartyCache(ttl=0.05)
+    cache.put(party("1", "one@example.com"))
+    assert cache.get_by_id("1")
+
+    time.sleep(0.1)
+
+    assert cache.get_by_id("1") is None
+    assert cache.stats()["bytes"] == 0
+
+
+def test_least_recently_used_parties_are_evicted_past_max_bytes():
+    cache = PartyCache(max_bytes=2 * len(json.dumps(party("1", "one@example.com"))))
+    cache.put(party("1", "one@example.com"))
+    cache.put(party("2", "two@example.com"))
+    cache.get_by_id("1")
+
+    cache.put(party("3", "six@example.com"))
+
+    assert cache.get_by_id("2") is None
+    assert cache.get_by_id("1")["Id"] == "1"
+    assert cache.get_by_id("3")["Id"] == "3"
+    assert cache.stats()["bytes"] <= cache.max_bytes
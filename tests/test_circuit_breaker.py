@@ -0,0 +1,48 @@
+"""Tests of the circuit breaker."""
+
+import time
+
+from target_imis.circuit_breaker import CircuitBreaker, is_server_error
+
+
+def test_server_errors_exclude_throttling():
+    assert is_server_error(500)
+    assert not is_server_error(503)
+    assert not is_server_error(429)
+    assert not is_server_error(404)
+    assert not is_server_error(None)
+
+
+def test_opens_once_enough_requests_failed():
+    breaker = CircuitBreaker(error_rate=0.5, min_requests=4, cooldown=60)
+    for status_code in (500, 200, 500):
+        breaker.record(status_code)
+    assert not breaker.is_open
+    breaker.record(200)
+    # Two of four isn't more than half
+    assert not breaker.is_open
+    breaker.record(500)
+    assert breaker.is_open
+    assert breaker.trips == 1
+
+
+def test_closes_after_the_cooldown_with_an_empty_window():
+    breaker = CircuitBreaker(error_rate=0.5, min_requests=2, cooldown=0.1)
+    breaker.record(500)
+    breaker.record(500)
+    assert breaker.is_open
+    time.sleep(0.15)
+    assert not breaker.is_open
+    # The failures that tripped it don't count anymore
+    breaker.record(500)
+    assert not breaker.is_open
+    breaker.record(500)
+    assert breaker.is_open
+    assert breaker.trips == 2
+
+
+def test_disabled_with_a_zero_error_rate():
+    breaker = CircuitBreaker(error_rate=0, min_requests=1)
+    for _ in range(10):
+        breaker.record(500)
+    assert not breaker.is_open
@@ -1,39 +1,647 @@
-"""Tests standard target features using the built-in SDK tests library."""
+"""End-to-end tests of the target against the fake iMIS server."""
 
-from __future__ import annotations
+import backoff
+import io
+import json
+import logging
+import os
+import pytz
+import subprocess
+import sys
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
 
-import typing as t
+from target_imis.client import IMISSink
+from target_imis.mapping import ActivityMapping
+from target_imis.target import TargetIMIS
+from tests.benchmark import run_benchmark
 
-import pytest
-from hotglue_singer_sdk.testing import get_target_test_class
+SAMPLE_PAYLOAD = os.path.join(os.path.dirname(__file__), "..", "sample_payload", "data.singer")
 
-from target_actionkit.target import TargetActionKit
 
-# TODO: Initialize minimal target config
-SAMPLE_CONFIG: dict[str, t.Any] = {}
+def run_target(config_path, lines):
+    """Run the target over Singer messages and return the last state it emitted."""
+    output = io.StringIO()
+    with redirect_stdout(output):
+        TargetIMIS(config=[config_path]).listen(io.StringIO("".join(lines)))
+    states = [json.loads(line) for line in output.getvalue().splitlines() if line.startswith("{")]
+    return states[-1]
 
 
-# Run standard built-in target tests from the SDK:
-StandardTargetTests = get_target_test_class(
-    target_class=TargetActionKit,
-    config=SAMPLE_CONFIG,
-)
+def singer_lines(stream, properties, records):
+    """Return the Singer messages of a stream's schema and records."""
+    schema = {"type": "SCHEMA", "stream": stream, "key_properties": [], "schema": {
+        "type": "object", "properties": {name: {"type": [kind, "null"]} for name, kind in properties.items()},
+    }}
+    messages = [schema] + [{"type": "RECORD", "stream": stream, "record": record} for record in records]
+    return [json.dumps(message) + "\n" for message in messages]
 
 
-class TestTargetActionKit(StandardTargetTests):  # type: ignore[misc, valid-type]  # noqa: E501
-    """Standard Target Tests."""
+CONTACT_PROPERTIES = {"id": "string", "first_name": "string", "last_name": "string", "email": "string", "company_id": "string"}
+ACTIVITY_PROPERTIES = {"title": "string", "contact_email": "string", "contact_id": "string", "activity_date": "string", "notes": "string"}
 
-    @pytest.fixture(scope="class")
-    def resource(self):  # noqa: ANN201
-        """Generic external resource.
 
-        This fixture is useful for setup and teardown of external resources,
-        such output folders, tables, buckets etc. for use during testing.
+def create_contacts(imis, count):
+    """Store `count` people in the fake iMIS, return their ids."""
+    return [
+        imis.create_party({
+            "PersonName": {"FirstName": f"First{number}", "LastName": "Lee"},
+            "Emails": {"$values": [{"Address": f"user{number}@example.com"}]},
+        })["Id"]
+        for number in range(count)
+    ]
 
-        Example usage can be found in the SDK samples test suite:
-        https://github.com/meltano/sdk/tree/main/tests/samples
-        """
-        return "resource"
 
+def test_sample_payload(fake_imis, target_config):
+    with open(SAMPLE_PAYLOAD) as payload:
+        lines = payload.readlines()
 
-# TODO: Create additional tests as appropriate for your target.
+    state = run_target(target_config(), lines)
+
+    contacts = state["bookmarks"]["Contacts"]
+    assert [contact["externalId"] for contact in contacts] == ["TEST001", "TEST002", "TEST003"]
+    assert all(contact["success"] for contact in contacts)
+    assert all(activity["success"] for activity in state["bookmarks"]["Activities"])
+    people = [party for party in fake_imis.imis.parties.values() if "PersonName" in party]
+    assert sorted(party["PersonName"]["LastName"] for party in people) == ["Doe", "Johnson", "Smith"]
+    assert len(fake_imis.imis.activities) == len(state["bookmarks"]["Activities"])
+
+
+def test_sample_payload_rerun_updates_existing_contacts(fake_imis, target_config):
+    with open(SAMPLE_PAYLOAD) as payload:
+        lines = payload.readlines()
+
+    run_target(target_config(), lines)
+    state = run_target(target_config(), lines)
+
+    assert len([party for party in fake_imis.imis.parties.values() if "PersonName" in party]) == 3
+    assert all(contact["success"] for contact in state["bookmarks"]["Contacts"])
+
+
+def test_benchmark_smoke():
+    report = run_benchmark(contacts=50, activities=50, config={"max_requests_per_second": 0, "max_workers": 4})
+
+    assert report["records"] == 100
+    assert report["request_counts"]["POST Party"] == 50
+    assert report["request_counts"]["POST Activity"] == 50
+    assert report["records_per_second"] > 0
+    assert report["p99_latency_ms"] >= report["p50_latency_ms"]
+
+
+def test_records_for_the_same_contact_are_coalesced(fake_imis, target_config):
+    schema = {"type": "SCHEMA", "stream": "Contacts", "key_properties": [], "schema": {"type": "object", "properties": {
+        "first_name": {"type": ["string", "null"]},
+        "last_name": {"type": ["string", "null"]},
+        "email": {"type": ["string", "null"]},
+        "externalId": {"type": ["string", "null"]},
+        "phone_numbers": {"type": ["array", "null"], "items": {"type": "object"}},
+    }}}
+    records = [
+        {"first_name": "Ann", "last_name": "Lee", "email": "ann@example.com", "externalId": "A1", "phone_numbers": [{"number": "5551", "type": "mobile"}]},
+        {"first_name": "Bob", "last_name": "Roe", "email": "bob@example.com", "externalId": "B1"},
+        {"first_name": "Annie", "last_name": "Lee", "email": "ANN@example.com", "externalId": "A2", "phone_numbers": [{"number": "5552", "type": "work"}]},
+    ]
+    lines = [json.dumps(schema) + "\n"] + [json.dumps({"type": "RECORD", "stream": "Contacts", "record": record}) + "\n" for record in records]
+
+    state = run_target(target_config(batch_size=10), lines)
+
+    assert fake_imis.imis.request_counts["POST Party"] == 2
+    contacts = state["bookmarks"]["Contacts"]
+    assert [(contact["externalId"], contact.get("coalesced", False)) for contact in contacts] == [("A1", False), ("A2", True), ("B1", False)]
+    assert all(contact["success"] for contact in contacts)
+    assert contacts[0]["id"] == contacts[1]["id"]
+    ann = fake_imis.imis.parties[contacts[0]["id"]]
+    assert ann["PersonName"]["FirstName"] == "Annie"
+    assert [phone["Number"] for phone in ann["Phones"]["$values"]] == ["5551", "5552"]
+
+
+def test_rerun_skips_records_committed_to_the_journal(fake_imis, target_config, tmp_path):
+    with open(SAMPLE_PAYLOAD) as payload:
+        lines = payload.readlines()
+    config_path = target_config(journal_path=str(tmp_path / "journal.jsonl"))
+
+    first_state = run_target(config_path, lines)
+    requests_sent = dict(fake_imis.imis.request_counts)
+    state = run_target(config_path, lines)
+
+    assert fake_imis.imis.request_counts == requests_sent
+    contacts = state["bookmarks"]["Contacts"]
+    assert all(contact["journaled"] for contact in contacts)
+    assert [contact["id"] for contact in contacts] == [contact["id"] for contact in first_state["bookmarks"]["Contacts"]]
+    assert all(activity["journaled"] for activity in state["bookmarks"]["Activities"])
+
+
+def test_records_already_written_are_counted_rather_than_logged(fake_imis, target_config, tmp_path, caplog):
+    records = [{"first_name": f"First{number}", "last_name": "Lee", "email": f"user{number}@example.com"} for number in range(5)]
+    lines = singer_lines("Contacts", CONTACT_PROPERTIES, records)
+    config_path = target_config(journal_path=str(tmp_path / "journal.jsonl"))
+    run_target(config_path, lines)
+
+    # The target's logger doesn't propagate to the root logger caplog listens on
+    target_logger = logging.getLogger(TargetIMIS.name)
+    target_logger.addHandler(caplog.handler)
+    try:
+        run_target(config_path, lines)
+    finally:
+        target_logger.removeHandler(caplog.handler)
+
+    messages = [record.getMessage() for record in caplog.records if record.levelno == logging.INFO]
+    assert not [message for message in messages if "already exists" in message or "processed id" in message]
+    assert any(message.startswith("Progress: 5 records") and "5 already written" in message for message in messages)
+
+
+def test_activities_for_an_unknown_email_fail_after_one_lookup(fake_imis, target_config):
+    schemas = [
+        {"type": "SCHEMA", "stream": "Activities", "key_properties": [], "schema": {"type": "object", "properties": {
+            "title": {"type": ["string", "null"]},
+            "contact_email": {"type": ["string", "null"]},
+        }}},
+        {"type": "SCHEMA", "stream": "Contacts", "key_properties": [], "schema": {"type": "object", "properties": {
+            "first_name": {"type": ["string", "null"]},
+            "last_name": {"type": ["string", "null"]},
+            "email": {"type": ["string", "null"]},
+        }}},
+    ]
+    messages = [{"type": "RECORD", "stream": "Activities", "record": {"title": f"Call {number}", "contact_email": "ghost@example.com"}} for number in range(5)]
+    messages.append({"type": "RECORD", "stream": "Contacts", "record": {"first_name": "Gus", "last_name": "Host", "email": "Ghost@example.com"}})
+    messages.append({"type": "RECORD", "stream": "Activities", "record": {"title": "Call 5", "contact_email": "ghost@example.com"}})
+    lines = [json.dumps(message) + "\n" for message in schemas + messages]
+
+    state = run_target(target_config(), lines)
+
+    activities = state["bookmarks"]["Activities"]
+    assert [activity["success"] for activity in activities] == [False] * 5 + [True]
+    # One search for the activities, one for the contact
+    assert fake_imis.imis.request_counts["GET Party"] == 2
+    assert len(fake_imis.imis.activities) == 1
+
+
+def test_import_does_not_load_optional_modules():
+    output = subprocess.run(
+        [sys.executable, "-c", "import sys, target_imis.target; print(' '.join(sys.modules))"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+
+    loaded = set(output.split())
+    assert "target_imis.sinks" in loaded
+    assert not loaded & {"sqlite3", "target_imis.identity_index", "target_imis.journal"}
+
+
+def test_about_needs_no_network():
+    # Any request would go through a proxy nothing listens on
+    env = dict(os.environ, HTTP_PROXY="http://127.0.0.1:9", HTTPS_PROXY="http://127.0.0.1:9")
+    result = subprocess.run(
+        [sys.executable, "-m", "target_imis.target", "--about", "--format", "json"],
+        capture_output=True,
+        text=True,
+        env=env,
+        timeout=60,
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert json.loads(result.stdout)["name"] == "target-imis"
+
+
+def test_address_purposes_are_cached_across_runs(fake_imis, target_config, tmp_path):
+    schema = {"type": "SCHEMA", "stream": "Contacts", "key_properties": [], "schema": {"type": "object", "properties": {
+        "first_name": {"type": ["string", "null"]},
+        "last_name": {"type": ["string", "null"]},
+        "email": {"type": ["string", "null"]},
+        "addresses": {"type": ["array", "null"], "items": {"type": "object"}},
+    }}}
+    record = {"first_name": "Ann", "last_name": "Lee", "email": "ann@example.com", "addresses": [{"line1": "1 Main St", "city": "Toronto"}]}
+    lines = [json.dumps(schema) + "\n", json.dumps({"type": "RECORD", "stream": "Contacts", "record": record}) + "\n"]
+    config_path = target_config(reference_cache_dir=str(tmp_path / "reference"))
+
+    run_target(config_path, lines)
+    run_target(config_path, lines)
+
+    assert fake_imis.imis.request_counts["GET AddressPurpose"] == 1
+    party = next(party for party in fake_imis.imis.parties.values() if "PersonName" in party)
+    assert party["Addresses"]["$values"][0]["AddressPurpose"] == "Home Address"
+
+    run_target(target_config(reference_cache_dir=str(tmp_path / "reference"), reference_cache_refresh=True), lines)
+
+    assert fake_imis.imis.request_counts["GET AddressPurpose"] == 2
+
+
+def test_only_upsert_empty_fields_fills_empty_fields_and_skips_filled_contacts(fake_imis, target_config):
+    schema = {"type": "SCHEMA", "stream": "Contacts", "key_properties": [], "schema": {"type": "object", "properties": {
+        "first_name": {"type": ["string", "null"]},
+        "last_name": {"type": ["string", "null"]},
+        "email": {"type": ["string", "null"]},
+        "phone_numbers": {"type": ["array", "null"], "items": {"type": "object"}},
+    }}}
+
+    def lines(record):
+        return [json.dumps(schema) + "\n", json.dumps({"type": "RECORD", "stream": "Contacts", "record": record}) + "\n"]
+
+    run_target(target_config(), lines({"first_name": "Ann", "last_name": "Lee", "email": "ann@example.com"}))
+    enrichment = lines({"first_name": "Annie", "last_name": "Lee", "email": "ann@example.com", "phone_numbers": [{"number": "5551", "type": "mobile"}]})
+    config_path = target_config(only_upsert_empty_fields=True)
+
+    run_target(config_path, enrichment)
+
+    assert fake_imis.imis.request_counts["PUT Party/{id}"] == 1
+    ann = next(party for party in fake_imis.imis.parties.values() if "PersonName" in party)
+    assert ann["PersonName"]["FirstName"] == "Ann"
+    assert [phone["Number"] for phone in ann["Phones"]["$values"]] == ["5551"]
+
+    state = run_target(config_path, enrichment)
+
+    assert fake_imis.imis.request_counts["PUT Party/{id}"] == 1
+    assert state["bookmarks"]["Contacts"][0]["success"]
+
+
+def test_parallel_streams_wait_only_for_pending_contacts(fake_imis, target_config):
+    schemas = [
+        {"type": "SCHEMA", "stream": "Contacts", "key_properties": [], "schema": {"type": "object", "properties": {
+            "first_name": {"type": ["string", "null"]},
+            "last_name": {"type": ["string", "null"]},
+            "email": {"type": ["string", "null"]},
+        }}},
+        {"type": "SCHEMA", "stream": "Activities", "key_properties": [], "schema": {"type": "object", "properties": {
+            "title": {"type": ["string", "null"]},
+            "contact_email": {"type": ["string", "null"]},
+        }}},
+    ]
+    messages = []
+    for number in range(30):
+        messages.append({"type": "RECORD", "stream": "Contacts", "record": {"first_name": f"First{number}", "last_name": "Lee", "email": f"user{number}@example.com"}})
+        messages.append({"type": "RECORD", "stream": "Activities", "record": {"title": f"Call {number}", "contact_email": f"USER{number}@example.com"}})
+    lines = [json.dumps(message) + "\n" for message in schemas + messages]
+
+    # Contacts are buffered in batches the activities can't wait for to fill up
+    state = run_target(target_config(parallel_streams=True, batch_size=20, max_workers=4), lines)
+
+    assert len(state["bookmarks"]["Contacts"]) == 30
+    activities = state["bookmarks"]["Activities"]
+    assert len(activities) == 30
+    assert all(activity["success"] for activity in activities)
+    assert len(fake_imis.imis.activities) == 30
+
+
+def test_poison_records_are_dead_lettered_within_their_retry_budget(fake_imis, target_config, tmp_path):
+    fake_imis.imis.poison = "Poison"
+    schema = {"type": "SCHEMA", "stream": "Contacts", "key_properties": [], "schema": {"type": "object", "properties": {
+        "first_name": {"type": ["string", "null"]},
+        "last_name": {"type": ["string", "null"]},
+        "email": {"type": ["string", "null"]},
+    }}}
+    records = [
+        {"first_name": "Ann", "last_name": "Lee", "email": "ann@example.com"},
+        {"first_name": "Pat", "last_name": "Poison", "email": "pat@example.com"},
+        {"first_name": "Bob", "last_name": "Roe", "email": "bob@example.com"},
+    ]
+    lines = [json.dumps(schema) + "\n"] + [json.dumps({"type": "RECORD", "stream": "Contacts", "record": record}) + "\n" for record in records]
+    dead_letter_path = tmp_path / "dead_letters.jsonl"
+
+    state = run_target(target_config(dead_letter_path=str(dead_letter_path)), lines)
+
+    assert [contact["success"] for contact in state["bookmarks"]["Contacts"]] == [True, False, True]
+    # Two successful POSTs, and two attempts of the poison one
+    assert fake_imis.imis.request_counts["POST Party"] == 4
+    dead_letters = [json.loads(line) for line in dead_letter_path.read_text().splitlines()]
+    assert len(dead_letters) == 1
+    assert dead_letters[0]["error_class"] == "RetriableInvalidPayloadError"
+    assert dead_letters[0]["status_code"] == 500
+    assert dead_letters[0]["record"]["PersonName"]["LastName"] == "Poison"
+
+
+def test_recorded_run_replays_offline(fake_imis, target_config, tmp_path):
+    with open(SAMPLE_PAYLOAD) as payload:
+        lines = payload.readlines()
+    cassette_path = str(tmp_path / "cassette.jsonl")
+
+    recorded_state = run_target(target_config(http_cassette_mode="record", http_cassette_path=cassette_path), lines)
+    requests_sent = dict(fake_imis.imis.request_counts)
+    with open(cassette_path) as cassette:
+        token_exchange = next(entry for entry in map(json.loads, cassette) if entry["url"].endswith("/Token"))
+    state = run_target(target_config(http_cassette_mode="replay", http_cassette_path=cassette_path, http_cassette_latency_scale=0), lines)
+
+    assert fake_imis.imis.request_counts == requests_sent
+    assert token_exchange["request_body"] == "<redacted>"
+    assert json.loads(token_exchange["body"])["access_token"] == "<redacted>"
+    for stream in ("Contacts", "Activities"):
+        assert [bookmark.get("id") for bookmark in state["bookmarks"][stream]] == [bookmark.get("id") for bookmark in recorded_state["bookmarks"][stream]]
+        assert all(bookmark["success"] for bookmark in state["bookmarks"][stream])
+
+
+def test_profile_option_writes_a_report(fake_imis, target_config, tmp_path):
+    profile_path = tmp_path / "run.prof"
+
+    result = subprocess.run(
+        [sys.executable, "-m", "target_imis.target", "--config", target_config(max_workers=2), "--input", SAMPLE_PAYLOAD, "--profile", str(profile_path)],
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert profile_path.exists()
+    report = (tmp_path / "run.prof.txt").read_text()
+    assert "upsert_record" in report
+
+
+def test_sequential_lookup_learns_the_field_that_matches(fake_imis, target_config):
+    schema = {"type": "SCHEMA", "stream": "Contacts", "key_properties": [], "schema": {"type": "object", "properties": {
+        "id": {"type": ["string", "null"]},
+        "first_name": {"type": ["string", "null"]},
+        "last_name": {"type": ["string", "null"]},
+        "email": {"type": ["string", "null"]},
+    }}}
+    names = ["Ann", "Bob", "Cid", "Dee", "Eve", "Fay"]
+    party_ids = [
+        fake_imis.imis.create_party({
+            "PersonName": {"FirstName": name, "LastName": "Lee"},
+            "Emails": {"$values": [{"Address": f"{name.lower()}@example.com"}]},
+        })["Id"]
+        for name in names
+    ]
+
+    def lines(records):
+        return [json.dumps(message) + "\n" for message in [schema] + [
+            {"type": "RECORD", "stream": "Contacts", "record": record} for record in records
+        ]]
+
+    # The source's ids are unknown to iMIS, their emails aren't, and every contact is a Lee
+    records = [{"id": f"X{name}", "first_name": name, "last_name": "Lee", "email": f"{name.lower()}@example.com"} for name in names]
+    state = run_target(target_config(lookup_fields={"Contact": ["id", "last_name", "email"]}, lookup_method="sequential"), lines(records))
+
+    # One id search, then the email is tried first
+    assert fake_imis.imis.request_counts["GET Party"] == len(names) + 1
+    assert [contact["id"] for contact in state["bookmarks"]["Contacts"]] == party_ids
+
+    # Namesakes are told apart by the first name, searched along with the last name once they prove ambiguous
+    fake_imis.imis.request_counts.clear()
+    records = [{"first_name": name, "last_name": "Lee"} for name in names]
+    config_path = target_config(lookup_fields={"Contact": ["last_name", "first_name"]}, lookup_method="sequential")
+    run_target(config_path, lines([dict(record, email=f"new.{record['first_name'].lower()}@example.com") for record in records]))
+
+    assert fake_imis.imis.request_counts["GET Party"] == len(names)
+    assert "POST Party" not in fake_imis.imis.request_counts
+    for party_id, name in zip(party_ids, names):
+        emails = [email["Address"] for email in fake_imis.imis.parties[party_id]["Emails"]["$values"]]
+        assert f"new.{name.lower()}@example.com" in emails
+
+
+def test_batched_contacts_are_looked_up_with_one_query_per_batch(fake_imis, target_config):
+    party_ids = create_contacts(fake_imis.imis, 20)
+    records = [{"first_name": f"Renamed{number}", "last_name": "Lee", "email": f"USER{number}@example.com"} for number in range(20)]
+
+    state = run_target(target_config(batch_size=10), singer_lines("Contacts", CONTACT_PROPERTIES, records))
+
+    assert fake_imis.imis.request_counts["GET Party"] == 2
+    assert fake_imis.imis.request_counts["PUT Party/{id}"] == 20
+    assert "POST Party" not in fake_imis.imis.request_counts
+    assert [contact["id"] for contact in state["bookmarks"]["Contacts"]] == party_ids
+
+
+def test_activities_find_upserted_contacts_in_the_party_cache(fake_imis, target_config):
+    contacts = [{"first_name": f"First{number}", "last_name": "Lee", "email": f"user{number}@example.com"} for number in range(5)]
+    activities = [{"title": f"Call {number}", "contact_email": f"USER{number}@example.com"} for number in range(5)]
+    lines = singer_lines("Contacts", CONTACT_PROPERTIES, contacts) + singer_lines("Activities", ACTIVITY_PROPERTIES, activities)
+
+    run_target(target_config(), lines)
+
+    # One search per new contact, none for their activities
+    assert fake_imis.imis.request_counts["GET Party"] == 5
+    assert fake_imis.imis.request_counts["POST Activity"] == 5
+
+    # Parties expired from the cache are searched again
+    fake_imis.imis.request_counts.clear()
+    activities = [dict(activity, title=f"Follow-up {number}") for number, activity in enumerate(activities)]
+    lines = singer_lines("Contacts", CONTACT_PROPERTIES, contacts) + singer_lines("Activities", ACTIVITY_PROPERTIES, activities)
+    run_target(target_config(party_cache_ttl=0.000001), lines)
+
+    assert fake_imis.imis.request_counts["GET Party"] == 10
+
+
+def test_duplicate_records_of_a_batch_are_written_once(fake_imis, target_config, monkeypatch):
+    # Copies are duplicates only within the same TRANSACTION_DATE second
+    monkeypatch.setattr(ActivityMapping, "transaction_date", lambda self: "2026-01-02T03:04:05")
+    create_contacts(fake_imis.imis, 1)
+    lines = singer_lines("Activities", ACTIVITY_PROPERTIES, [{"title": "Call", "contact_email": "user0@example.com"}] * 3)
+
+    for settings in [{}, {"batch_size": 10}, {"batch_size": 10, "max_workers": 4}]:
+        fake_imis.imis.request_counts.clear()
+        state = run_target(target_config(**settings), lines)
+
+        assert fake_imis.imis.request_counts["POST Activity"] == 1, settings
+        assert state["summary"]["Activities"]["existing"] == 2, settings
+
+
+def test_unchanged_contacts_are_not_written_again(fake_imis, target_config):
+    contacts = [{"first_name": f"First{number}", "last_name": "Lee", "email": f"user{number}@example.com"} for number in range(3)]
+    lines = singer_lines("Contacts", CONTACT_PROPERTIES, contacts)
+    run_target(target_config(), lines)
+    assert fake_imis.imis.request_counts["POST Party"] == 3
+
+    state = run_target(target_config(), lines)
+
+    assert "PUT Party/{id}" not in fake_imis.imis.request_counts
+    assert all(contact["unchanged"] for contact in state["bookmarks"]["Contacts"])
+
+    contacts[1]["last_name"] = "Smith"
+    run_target(target_config(), singer_lines("Contacts", CONTACT_PROPERTIES, contacts))
+    assert fake_imis.imis.request_counts["PUT Party/{id}"] == 1
+
+    run_target(target_config(skip_unchanged_records=False), singer_lines("Contacts", CONTACT_PROPERTIES, contacts))
+    assert fake_imis.imis.request_counts["PUT Party/{id}"] == 4
+
+
+def test_identity_index_entries_must_match_the_lookup_fields(fake_imis, target_config, tmp_path):
+    properties = dict(CONTACT_PROPERTIES, externalId="string")
+    config_path = target_config(identity_index_path=str(tmp_path / "identities.db"))
+    first_state = run_target(config_path, singer_lines("Contacts", properties, [
+        {"externalId": "EXT1", "first_name": "Ann", "last_name": "Lee", "email": "ann@example.com"},
+    ]))
+    ann_id = first_state["bookmarks"]["Contacts"][0]["id"]
+
+    # The source now uses the externalId for someone else, the email lookup doesn't match Ann
+    state = run_target(config_path, singer_lines("Contacts", properties, [
+        {"externalId": "EXT1", "first_name": "Bob", "last_name": "Lee", "email": "bob@example.com"},
+    ]))
+
+    assert state["bookmarks"]["Contacts"][0]["id"] != ann_id
+    assert fake_imis.imis.request_counts["POST Party"] == 2
+    assert fake_imis.imis.parties[ann_id]["PersonName"]["FirstName"] == "Ann"
+
+
+def test_organizations_are_preloaded_instead_of_fetched_per_contact(fake_imis, target_config):
+    contacts = [
+        {"first_name": f"First{number}", "last_name": "Lee", "email": f"user{number}@example.com", "company_id": str(100 + number % 5)}
+        for number in range(10)
+    ]
+    lines = singer_lines("Contacts", CONTACT_PROPERTIES, contacts)
+
+    # Per record, each organization is fetched once and then found in the Party cache
+    run_target(target_config(), lines)
+    assert fake_imis.imis.request_counts["GET Party"] == 10 + 5
+
+    fake_imis.imis.request_counts.clear()
+    run_target(target_config(preload_organizations="all", skip_unchanged_records=False), lines)
+    assert fake_imis.imis.request_counts["GET Organization"] == 1
+    assert fake_imis.imis.request_counts["GET Party"] == 10
+
+    fake_imis.imis.request_counts.clear()
+    run_target(target_config(preload_organizations="batch", batch_size=10, skip_unchanged_records=False), lines)
+    assert "GET Organization" not in fake_imis.imis.request_counts
+    # One query for the batch's organizations, one for its contacts
+    assert fake_imis.imis.request_counts["GET Party"] == 2
+
+    people = [party for party in fake_imis.imis.parties.values() if "PersonName" in party]
+    assert [party["PrimaryOrganization"]["Name"] for party in people] == [f"Organization {100 + number % 5}" for number in range(10)]
+
+
+def test_failed_bookmarks_stay_in_the_state_past_the_bookmark_window(fake_imis, target_config, tmp_path):
+    create_contacts(fake_imis.imis, 1)
+    activities = [
+        {"title": f"Call {number}", "contact_email": "nobody@example.com" if number in (1, 4, 7, 10, 13) else "user0@example.com"}
+        for number in range(20)
+    ]
+    spill_path = tmp_path / "{stream}.jsonl"
+
+    state = run_target(
+        target_config(bookmark_window=3, bookmark_spill_path=str(spill_path)),
+        singer_lines("Activities", ACTIVITY_PROPERTIES, activities),
+    )
+
+    # The first failures up to the window stay in the state, the later ones are spilled
+    bookmarks = state["bookmarks"]["Activities"]
+    assert [bookmark["success"] for bookmark in bookmarks[:3]] == [False, False, False]
+    assert all(bookmark["success"] for bookmark in bookmarks[3:])
+    summary = state["summary"]["Activities"]
+    spilled = [json.loads(line) for line in (tmp_path / "Activities.jsonl").read_text().splitlines()]
+    assert summary["spilled_bookmarks"] == len(spilled) == 20 - len(bookmarks)
+    assert summary["spilled_failures"] == len([bookmark for bookmark in spilled if not bookmark["success"]]) == 2
+    assert summary["fail"] == 5
+
+
+def test_activities_follow_the_configured_mappings_and_timezone(fake_imis, target_config):
+    party_id, = create_contacts(fake_imis.imis, 1)
+    properties = dict(ACTIVITY_PROPERTIES, note="string", campaign_code="string", custom_fields="array")
+    activity = {
+        "title": "Call", "note": "Dropped", "campaign_code": "SPRING", "contact_email": "user0@example.com",
+        "custom_fields": [{"name": "UF3", "value": "Board"}],
+    }
+
+    run_target(
+        target_config(activity_field_mappings={"campaign_code": "UF2", "note": None}, activity_timezone="Asia/Tokyo"),
+        singer_lines("Activities", properties, [activity]),
+    )
+
+    assert fake_imis.imis.request_counts["POST Activity"] == 1
+    payload = next(iter(fake_imis.imis.activity_payloads.values()))
+    values = {value["Name"]: value["Value"] for value in payload["properties"]["$values"]}
+    assert {name: value for name, value in values.items() if name != "TRANSACTION_DATE"} == {
+        "PartyId": party_id,
+        "TITLE": "Call",
+        "UF2": "SPRING",
+        "UF3": "Board",
+    }
+    transaction_date = pytz.timezone("Asia/Tokyo").localize(datetime.strptime(values["TRANSACTION_DATE"], "%Y-%m-%dT%H:%M:%S"))
+    assert abs((datetime.now(timezone.utc) - transaction_date).total_seconds()) < 60
+
+
+def test_batched_activities_resolve_their_contacts_with_one_query(fake_imis, target_config):
+    create_contacts(fake_imis.imis, 10)
+    activities = [{"title": f"Call {number}", "contact_email": f"User{number % 10}@example.com"} for number in range(20)]
+    activities += [{"title": "Lost call", "contact_email": "nobody@example.com"}]
+
+    state = run_target(target_config(batch_size=25), singer_lines("Activities", ACTIVITY_PROPERTIES, activities))
+
+    # Known and unknown emails alike come from the one prefetch query
+    assert fake_imis.imis.request_counts["GET Party"] == 1
+    assert fake_imis.imis.request_counts["POST Activity"] == 20
+    assert [activity["success"] for activity in state["bookmarks"]["Activities"]] == [True] * 20 + [False]
+
+
+def test_activity_read_before_its_buffered_contact_does_not_stall(fake_imis, target_config):
+    create_contacts(fake_imis.imis, 8)
+    activity_schema, first_call = singer_lines("Activities", ACTIVITY_PROPERTIES, [{"title": "First call", "contact_email": "new@example.com"}])
+    contact_schema, new_contact = singer_lines("Contacts", CONTACT_PROPERTIES, [{"first_name": "New", "last_name": "Lee", "email": "new@example.com"}])
+    calls = singer_lines("Activities", ACTIVITY_PROPERTIES, [{"title": f"Call {number}", "contact_email": f"user{number}@example.com"} for number in range(8)])[1:]
+    # The contact is read after its activity and sits alone in a Contacts batch, while the activities fill up their stream's queue
+    lines = [activity_schema, contact_schema, first_call, new_contact] + calls
+    config_path = target_config(parallel_streams=True, batch_size=2, pending_contact_timeout=5)
+
+    started_at = time.monotonic()
+    state = run_target(config_path, lines)
+
+    assert time.monotonic() - started_at < 5
+    activities = state["bookmarks"]["Activities"]
+    assert len(activities) == 9
+    assert all(activity["success"] for activity in activities)
+
+
+def test_circuit_breaker_fails_records_fast_while_imis_is_failing(fake_imis, target_config, monkeypatch):
+    # No backoff waits, the retries are counted rather than timed
+    monkeypatch.setattr(IMISSink, "backoff_wait_generator", lambda self: backoff.constant(interval=0))
+    fake_imis.imis.error_rate = 1.0
+    records = [{"first_name": f"First{number}", "last_name": "Lee", "email": f"user{number}@example.com"} for number in range(10)]
+    lines = singer_lines("Contacts", CONTACT_PROPERTIES, records)
+
+    state = run_target(target_config(payload_error_max_tries=4, circuit_breaker_error_rate=0), lines)
+    assert not any(contact["success"] for contact in state["bookmarks"]["Contacts"])
+    # Without the breaker every lookup is tried four times
+    assert fake_imis.imis.request_counts["GET Party"] == 40
+
+    fake_imis.imis.request_counts.clear()
+    config = target_config(payload_error_max_tries=4, circuit_breaker_min_requests=4, circuit_breaker_cooldown=60)
+    state = run_target(config, lines)
+    assert not any(contact["success"] for contact in state["bookmarks"]["Contacts"])
+    # The breaker opens on the first record's last try, the other records fail on their first
+    assert fake_imis.imis.request_counts["GET Party"] == 4 + 9
+    assert "POST Party" not in fake_imis.imis.request_counts
+
+
+def test_sequential_lookup_falls_back_to_names_after_the_email(fake_imis, target_config):
+    names = [("Ann", "Zed"), ("Bob", "Yu"), ("Cid", "Xi"), ("Dee", "Wu")]
+    party_ids = [
+        fake_imis.imis.create_party({
+            "PersonName": {"FirstName": first_name, "LastName": last_name},
+            "Emails": {"$values": [{"Address": f"{first_name.lower()}@example.com"}]},
+        })["Id"]
+        for first_name, last_name in names
+    ]
+    records = [
+        # Records without an email make the last name the field that matches most
+        {"last_name": "Xi"},
+        {"last_name": "Wu"},
+        # An email unknown to iMIS, the only Zed is still the contact
+        {"first_name": "Ann", "last_name": "Zed", "email": "ann.zed@example.com"},
+        # The email is tried first all the same, ahead of the Yu it doesn't belong to
+        {"last_name": "Yu", "email": "cid@example.com"},
+    ]
+    config = target_config(lookup_fields={"Contact": ["email", "last_name"]}, lookup_method="sequential")
+
+    state = run_target(config, singer_lines("Contacts", CONTACT_PROPERTIES, records))
+
+    assert [contact["id"] for contact in state["bookmarks"]["Contacts"]] == [party_ids[2], party_ids[3], party_ids[0], party_ids[2]]
+    assert "POST Party" not in fake_imis.imis.request_counts
+    emails = [email["Address"] for email in fake_imis.imis.parties[party_ids[0]]["Emails"]["$values"]]
+    assert "ann.zed@example.com" in emails
+    # The email and the last name for the third record, the last one finds Cid in the party cache
+    assert fake_imis.imis.request_counts["GET Party"] == 4
+
+
+def test_throttled_requests_lower_the_rate_without_a_configured_maximum(fake_imis, target_config, monkeypatch):
+    monkeypatch.setattr(IMISSink, "backoff_wait_generator", lambda self: backoff.constant(interval=0))
+    fake_imis.imis.throttle_rate = 0.3
+    records = [{"first_name": f"First{number}", "last_name": "Lee", "email": f"user{number}@example.com"} for number in range(5)]
+    target = TargetIMIS(config=[target_config(max_requests_per_second=0)])
+
+    started_at = time.monotonic()
+    with redirect_stdout(io.StringIO()):
+        target.listen(io.StringIO("".join(singer_lines("Contacts", CONTACT_PROPERTIES, records))))
+
+    rate_limiter = target.transport.rate_limiter
+    assert rate_limiter.throttled > 0
+    assert rate_limiter.rate is not None
+    # Every throttled response's Retry-After of a second was waited out, not only the backoff
+    assert time.monotonic() - started_at >= rate_limiter.throttled
+    assert len(fake_imis.imis.parties) == 5 + 5
@@ -0,0 +1,47 @@
+"""Tests of the write-ahead journal."""
+
+import os
+
+from target_imis.journal import Journal
+
+
+def test_committed_records_are_found_by_the_next_run(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = Journal(path, "https://imis.example.com")
+    journal.append("a", "1001", True)
+    journal.append("b", None, False)
+    journal.append("c", 7, True)
+    assert journal.get("a") == (True, "1001")
+    journal.close()
+
+    journal = Journal(path, "https://imis.example.com")
+    assert journal.get("a") == (True, "1001")
+    assert journal.get("b") == (False, None)
+    assert journal.get("c") == (True, 7)
+    journal.close()
+
+
+def test_the_index_replays_lines_it_missed_and_rebuilds_for_another_journal(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = Journal(path, "https://imis.example.com")
+    journal.append("a", "1001", True)
+    journal.close()
+
+    # Lines written without the index, like a run killed before it committed them, and a partial last line
+    with open(path, "a") as journal_file:
+        journal_file.write('{"key": "a", "id": null, "success": false}\n')
+        journal_file.write('{"key": "b", "id": "1002", "success": true}\n')
+        journal_file.write('{"key": "c", "id": "10')
+    journal = Journal(path, "https://imis.example.com")
+    assert journal.get("a") == (False, None)
+    assert journal.get("b") == (True, "1002")
+    assert journal.get("c") == (False, None)
+    journal.close()
+
+    os.remove(path)
+    with open(path, "w") as journal_file:
+        journal_file.write('{"key": "d", "id": "1003", "success": true}\n')
+    journal = Journal(path, "https://imis.example.com")
+    assert journal.get("b") == (False, None)
+    assert journal.get("d") == (True, "1003")
+    journal.close()
@@ -0,0 +1,105 @@
+"""Memory of large Contacts streams, the very large one runs with IMIS_MEMORY_TEST=1 (takes several minutes)."""
+
+import gc
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import tracemalloc
+from contextlib import redirect_stdout
+
+import pytest
+
+from tests.benchmark import fake_imis_process
+
+RECORDS = int(os.environ.get("IMIS_MEMORY_TEST_RECORDS", 1000000))
+MAX_RSS_MB = float(os.environ.get("IMIS_MEMORY_TEST_MAX_RSS_MB", 200))
+
+
+@pytest.mark.skipif(not os.environ.get("IMIS_MEMORY_TEST"), reason="slow, set IMIS_MEMORY_TEST=1 to run")
+def test_bounded_bookmarks_keep_memory_flat(tmp_path):
+    report_path = tmp_path / "report.json"
+    config = {"max_requests_per_second": 0, "bookmark_window": 1000, "bookmark_spill_path": str(tmp_path / "{stream}.jsonl")}
+    # Runs in its own process, so the peak RSS is the target's alone
+    subprocess.run(
+        [
+            sys.executable, "-m", "tests.benchmark",
+            "--contacts", str(RECORDS),
+            "--activities", "0",
+            "--duplicate-every", "1000",
+            "--config", json.dumps(config),
+            "--output", str(report_path),
+        ],
+        cwd=os.path.join(os.path.dirname(__file__), ".."),
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    report = json.loads(report_path.read_text())
+    assert report["records"] == RECORDS
+    assert report["peak_rss_mb"] < MAX_RSS_MB
+    with open(tmp_path / "Contacts.jsonl") as spill_file:
+        assert sum(1 for _ in spill_file) > RECORDS - 2000
+
+
+def retained_memory(url, tmp_path, contacts):
+    """Bytes the target still holds after a Contacts stream with a failure every fourth record."""
+    stream_path = tmp_path / f"{contacts}.singer"
+    schema = {"type": "object", "properties": {name: {"type": ["string", "null"]} for name in ("first_name", "last_name", "email")}}
+    messages = [{"type": "SCHEMA", "stream": "Contacts", "schema": schema, "key_properties": []}] + [
+        {"type": "RECORD", "stream": "Contacts", "record": {
+            "first_name": f"First{index}",
+            "last_name": "Poison" if index % 4 == 0 else f"Last{index}",
+            "email": f"user{index}@example.com",
+        }}
+        for index in range(contacts)
+    ]
+    stream_path.write_text("".join(json.dumps(message) + "\n" for message in messages))
+    config_path = tmp_path / f"{contacts}.json"
+    config_path.write_text(json.dumps({
+        "username": "test",
+        "password": "test",
+        "site_url": url,
+        "max_requests_per_second": 0,
+        "payload_error_max_tries": 1,
+        "bookmark_window": 50,
+        "bookmark_spill_path": str(tmp_path / f"{contacts}-{{stream}}.jsonl"),
+        "dedupe_window": 50,
+        "party_cache_max_mb": 0,
+        "journal_path": str(tmp_path / f"{contacts}-journal.jsonl"),
+    }))
+
+    from target_imis.target import TargetIMIS
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        target = TargetIMIS(config=[str(config_path)])
+        with open(stream_path) as stream, redirect_stdout(io.StringIO()):
+            target.listen(stream)
+        # Measured while the target, and what its sinks hold, is still alive
+        gc.collect()
+        retained, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return retained
+
+
+def test_failed_records_and_the_journal_keep_memory_flat(tmp_path):
+    # The fake iMIS runs in its own process, only the target's allocations are traced. Log
+    # records are off, pytest keeps every one it captures along with its traceback.
+    logging.disable(logging.CRITICAL)
+    try:
+        with fake_imis_process(poison="Poison") as url:
+            # Imports and other one-time allocations
+            retained_memory(url, tmp_path, 20)
+            small = retained_memory(url, tmp_path, 100)
+            large = retained_memory(url, tmp_path, 500)
+    finally:
+        logging.disable(logging.NOTSET)
+
+    # Five times the records, about the same memory
+    assert large - small < 48 * 1024
@@ -0,0 +1,110 @@
+"""Tests of the adaptive rate limiter."""
+
+import time
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+from target_imis.rate_limiter import AdaptiveRateLimiter, parse_retry_after
+
+
+def response(status_code, retry_after=None):
+    response = requests.Response()
+    response.status_code = status_code
+    if retry_after is not None:
+        response.headers["Retry-After"] = retry_after
+    return response
+
+
+def test_parse_retry_after_seconds_and_dates():
+    assert parse_retry_after("5") == 5.0
+    assert parse_retry_after("1.5") == 1.5
+    assert parse_retry_after("-3") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("") is None
+    assert parse_retry_after("soon") is None
+
+    in_a_minute = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=60), usegmt=True)
+    assert 55 <= parse_retry_after(in_a_minute) <= 60
+    a_minute_ago = format_datetime(datetime.now(timezone.utc) - timedelta(seconds=60), usegmt=True)
+    assert parse_retry_after(a_minute_ago) == 0.0
+
+
+def test_throttling_halves_the_rate_once_per_decrease_interval_down_to_the_minimum():
+    limiter = AdaptiveRateLimiter(max_rate=40, min_rate=8)
+
+    limiter.observe(response(429))
+    assert limiter.rate == 20
+    # Responses to requests already in flight don't lower it again
+    limiter.observe(response(503))
+    assert limiter.rate == 20
+
+    limiter.decrease_interval = 0
+    for _ in range(5):
+        limiter.observe(response(429))
+    assert limiter.rate == 8
+    assert limiter.metrics() == {"request_rate": 8, "throttled_responses": 7}
+
+
+def test_rate_recovers_after_consecutive_successes_up_to_the_maximum():
+    limiter = AdaptiveRateLimiter(max_rate=40, increase=5, success_threshold=3)
+    limiter.on_throttle()
+    assert limiter.rate == 20
+
+    for _ in range(2):
+        limiter.observe(response(200))
+    # Server errors are neither throttling nor successes
+    limiter.observe(response(500))
+    assert limiter.rate == 20
+    limiter.observe(response(404))
+    assert limiter.rate == 25
+
+    # A throttled response restarts the count
+    limiter.decrease_interval = 0
+    limiter.observe(response(200))
+    limiter.observe(response(429))
+    assert limiter.rate == 12.5
+
+    for _ in range(3 * 10):
+        limiter.on_success()
+    assert limiter.rate == 40
+
+
+def test_retry_after_pauses_every_request():
+    limiter = AdaptiveRateLimiter(max_rate=1000)
+    limiter.observe(response(429, retry_after="0.3"))
+
+    started_at = time.monotonic()
+    limiter.acquire()
+
+    assert time.monotonic() - started_at >= 0.25
+
+
+def test_without_a_maximum_requests_are_limited_only_once_throttled():
+    limiter = AdaptiveRateLimiter(increase=5, success_threshold=3)
+    assert limiter.metrics() == {"request_rate": None, "throttled_responses": 0}
+
+    started_at = time.monotonic()
+    for _ in range(100):
+        limiter.acquire()
+    assert time.monotonic() - started_at < 0.5
+
+    # Halved from the rate the requests went out at
+    limiter.observe(response(429))
+    assert limiter.rate == 50
+
+    # Recovers with no ceiling
+    for _ in range(3 * 20):
+        limiter.on_success()
+    assert limiter.rate == 150
+
+
+def test_without_a_maximum_retry_after_pauses_every_request():
+    limiter = AdaptiveRateLimiter()
+    limiter.observe(response(503, retry_after="0.3"))
+
+    started_at = time.monotonic()
+    limiter.acquire()
+
+    assert time.monotonic() - started_at >= 0.25